@@ -0,0 +1,109 @@
+'''
+Generates a synthetic PHP project for the benchmarks.
+
+Every file declares one or more classes with documented properties and
+methods. Classes are arranged in inheritance chains of a given depth, with
+the parent of each class declared in an earlier file, and every class
+implements a common interface.
+'''
+
+import os
+import random
+
+
+def class_name(n):
+    return 'Bench_Model_Class{n:d}'.format(n=n)
+
+
+def method(n, returns, static=False):
+    return '''
+    /**
+     * Method {n:d} of the generated class.
+     *
+     * @param string $name
+     * @param int $count
+     * @return {returns}
+     */
+    public {static}function method{n:d}($name, $count = 0, array $options = array())
+    {{
+        $result = array_map(function ($item) use ($count) {{
+            return $item . $count;
+        }}, $options);
+        if ($this->property{n:d} !== null) {{
+            return $this->property{n:d};
+        }}
+        return "{{$name}} " . count($result);
+    }}
+'''.format(n=n, returns=returns, static='static ' if static else '')
+
+
+def source(classes, depth, methods, first, total, rnd):
+    '''
+    Return the source of one file holding the classes numbered first to
+    first + classes - 1
+    '''
+    out = ['<?php', '']
+    for n in range(first, first + classes):
+        header = 'class ' + class_name(n)
+        if n % depth:
+            header += ' extends ' + class_name(n - 1)
+        header += ' implements Bench_Countable'
+        out.append('/**\n * Generated class {n:d}.\n */'.format(n=n))
+        out.append(header)
+        out.append('{')
+        out.append('    const VERSION = {n:d};'.format(n=n))
+        for m in range(0, methods):
+            out.append('    /** @var {returns} */'.format(returns=class_name(rnd.randint(0, total - 1))))
+            out.append('    protected $property{m:d};'.format(m=m))
+        for m in range(0, methods):
+            out.append(method(m, class_name(rnd.randint(0, total - 1)), m % 5 == 0))
+        out.append('}')
+        out.append('')
+
+    return '\n'.join(out)
+
+
+def generate(folder, files=200, classes=1, depth=4, methods=10, seed=0):
+    '''
+    Write files PHP files below folder, spread over sub folders, each
+    declaring classes classes with methods methods and properties. Returns
+    the paths of the files written.
+    '''
+    rnd = random.Random(seed)
+    total = files * classes
+    paths = []
+
+    base = os.path.join(folder, 'lib')
+    if not os.path.isdir(base):
+        os.makedirs(base)
+    with open(os.path.join(base, 'Countable.php'), 'w') as f:
+        f.write('<?php\ninterface Bench_Countable\n{\n    public function count();\n}\n')
+    paths.append(os.path.join(base, 'Countable.php'))
+
+    for i in range(0, files):
+        sub = os.path.join(folder, 'lib', 'module{n:d}'.format(n=i % 20))
+        if not os.path.isdir(sub):
+            os.makedirs(sub)
+        path = os.path.join(sub, 'Class{n:d}.php'.format(n=i))
+        with open(path, 'w') as f:
+            f.write(source(classes, depth, methods, i * classes, total, rnd))
+        paths.append(path)
+
+    return paths
+
+
+def completion_source(lines, class_index=0):
+    '''
+    Return a source roughly lines lines long, and the offset of a $this->
+    completion in the middle of its last method
+    '''
+    body = ['<?php', 'class ' + class_name(class_index) + '_Edit extends ' + class_name(class_index), '{']
+    n = 0
+    while len(body) < lines:
+        body.append('    public function edit{n:d}($a)\n    {{\n        $b = $this->method0($a, {n:d});\n        return $b;\n    }}'.format(n=n))
+        body.append('')
+        n += 1
+    text = '\n'.join(body) + '\n    public function current()\n    {\n        $this->'
+    point = len(text)
+
+    return text + '\n    }\n}\n', point
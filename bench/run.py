@@ -0,0 +1,269 @@
+'''
+Benchmarks for scanning, indexing and completion that run from a plain
+Python interpreter, outside of Sublime Text.
+
+A synthetic project is generated in a temporary folder and every stage is
+timed on it. The results are written as JSON so that runs from different
+releases can be compared:
+
+    python bench/run.py --files 1000 -o before.json
+    python bench/run.py --files 1000 -o after.json --compare before.json
+'''
+
+import os
+import sys
+import json
+import time
+import shutil
+import platform
+import tempfile
+from optparse import OptionParser
+
+bench_folder = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(bench_folder))
+sys.path.insert(0, bench_folder)
+
+import sublime
+import corpus
+import phpparser
+import intel
+import phpintel
+
+RESULTS_VERSION = 1
+CONTEXT_LINES = (100, 1000, 10000, 50000)
+
+
+def log(message):
+    sys.stderr.write(message + '\n')
+
+
+def measure(results, name, count, func):
+    '''
+    Time func(), which handles count items, and record it in results
+    '''
+    start = time.time()
+    func()
+    elapsed = time.time() - start
+    results[name] = {
+        'seconds': elapsed,
+        'count': count,
+        'per_item_ms': elapsed * 1000.0 / max(count, 1),
+    }
+    log('{name:<32} {seconds:10.4f}s {count:8d} x {per_item:10.4f}ms'.format(name=name, seconds=elapsed, count=count, per_item=results[name]['per_item_ms']))
+
+
+def bench_parser(results, paths):
+    declarations = {}
+
+    def scan():
+        for path in paths:
+            declarations[path] = phpparser.scan_file(path)
+
+    measure(results, 'scan_file', len(paths), scan)
+
+    tokens = [(path, phpparser.get_all_tokens(filename=path)) for path in paths]
+    phpparser.close_worker()
+
+    def convert():
+        for path, t in tokens:
+            phpparser.convert_raw_tokens(t, path)
+
+    measure(results, 'convert_raw_tokens', len(paths), convert)
+
+    return declarations
+
+
+def bench_index(results, declarations):
+    intel.reset()
+
+    def update():
+        for path, d in declarations.items():
+            intel.update_index(path, *set([x.class_name for x in d]))
+
+    measure(results, 'update_index', len(declarations), update)
+
+
+def bench_store(results, backend, folder, declarations):
+    shutil.rmtree(os.path.join(folder, '.phpintel'), True)
+    intel.set_store_backend(backend)
+    paths = declarations.keys()
+    cache_size = intel.cache_stats()['capacity']
+
+    def save():
+        for path in paths:
+            intel.save(declarations[path], folder, path)
+        intel.commit(folder)
+
+    def load():
+        for path in paths:
+            intel.load(folder, path)
+
+    measure(results, backend + '.save', len(paths), save)
+    intel.set_cache_size(0)
+    intel.set_cache_size(cache_size)
+    measure(results, backend + '.load', len(paths), load)
+    measure(results, backend + '.load_cached', len(paths), load)
+    index = intel.FolderIndex(folder)
+    for path in paths:
+        index.update(path, *set([x.class_name for x in declarations[path]]))
+    measure(results, backend + '.save_index', 1, index.save)
+
+    def load_index():
+        intel.reset()
+        intel.load_index(folder)
+
+    measure(results, backend + '.load_index', 1, load_index)
+
+    names = ['method0', 'property1', corpus.class_name(len(paths) / 2)]
+    measure(results, backend + '.find_symbol', len(names), lambda: [intel.find_symbol(name) for name in names])
+
+
+def bench_completion(results, folder, depth, repeat):
+    intel.reset()
+    intel.load_indexes([folder])
+
+    for lines in CONTEXT_LINES:
+        source, point = corpus.completion_source(lines, depth - 1)
+        view = sublime.View(source)
+        class_at = lambda p: phpintel._class_spans.class_at(view, source, p)
+
+        def context():
+            for i in range(0, repeat):
+                phpparser.get_context(source, point, class_at)
+
+        # As in on_query_completions, with $this resolved through the
+        # class span cache of the view. The first completion in a view
+        # fills the cache.
+        measure(results, 'get_context_first.{lines:d}_lines'.format(lines=lines), 1, lambda: phpparser.get_context(source, point, class_at))
+        measure(results, 'get_context.{lines:d}_lines'.format(lines=lines), repeat, context)
+        phpintel._class_spans.forget(view)
+
+    context = [corpus.class_name(depth - 1), '']
+
+    def complete():
+        found = []
+        context_class, context_partial = intel.get_class(list(context))
+        intel.find_completions(context, '->', context_class, context_partial, found, 'all')
+
+    measure(results, 'find_completions.first', 1, complete)
+    measure(results, 'find_completions', repeat, lambda: [complete() for i in range(0, repeat)])
+
+
+def bench_project_scan(results, backend, folder, paths, batch_size, workers):
+    shutil.rmtree(os.path.join(folder, '.phpintel'), True)
+    intel.set_store_backend(backend)
+    intel.reset()
+
+    def scan():
+        thread = phpintel.ScanThread([], [folder], batch_size, workers)
+        thread.queue('__all__')
+        thread.run()
+
+    measure(results, 'project_scan', len(paths), scan)
+    measure(results, 'project_rescan', len(paths), scan)
+
+
+def compare(results, filename, threshold):
+    '''
+    Print how each result changed from those saved in filename. Returns the
+    names of the results that got slower by more than threshold.
+    '''
+    with open(filename) as f:
+        baseline = json.load(f)['results']
+
+    slower = []
+    for name in sorted(results):
+        if name not in baseline:
+            continue
+        before = baseline[name]['per_item_ms']
+        after = results[name]['per_item_ms']
+        if before <= 0:
+            continue
+        ratio = after / before
+        flag = ''
+        # Ignore differences in very fast results, which are mostly noise
+        if ratio > threshold and results[name]['seconds'] > 0.05:
+            flag = '  SLOWER'
+            slower.append(name)
+        log('{name:<32} {before:10.4f}ms {after:10.4f}ms {ratio:6.2f}x{flag}'.format(name=name, before=before, after=after, ratio=ratio, flag=flag))
+
+    return slower
+
+
+def main():
+    parser = OptionParser(usage='%prog [options]')
+    parser.add_option('--files', type='int', default=200, help='number of PHP files to generate')
+    parser.add_option('--classes', type='int', default=1, help='classes per file')
+    parser.add_option('--depth', type='int', default=4, help='length of the inheritance chains')
+    parser.add_option('--methods', type='int', default=10, help='methods and properties per class')
+    parser.add_option('--seed', type='int', default=0, help='random seed for the corpus')
+    parser.add_option('--repeat', type='int', default=20, help='repeats for the completion benchmarks')
+    parser.add_option('--tokenizer', default='python', help="'php' or 'python'")
+    parser.add_option('--stores', default='files,sqlite', help='comma separated intel stores to benchmark')
+    parser.add_option('--batch-size', type='int', default=100, help='scan batch size')
+    parser.add_option('--workers', type='int', default=0, help='scan workers, 0 for one per CPU')
+    parser.add_option('-o', '--output', help='write the JSON results to this file instead of stdout')
+    parser.add_option('--compare', metavar='FILE', help='compare with results saved in FILE')
+    parser.add_option('--threshold', type='float', default=1.25, help='slowdown reported as a regression by --compare')
+    parser.add_option('--keep', action='store_true', help='keep the generated corpus')
+    options, args = parser.parse_args()
+
+    workers = options.workers
+    if workers < 1:
+        workers = phpintel.get_cpu_count()
+    stores = [s for s in options.stores.split(',') if s]
+    phpparser.set_tokenizer(options.tokenizer)
+
+    folder = tempfile.mkdtemp(prefix='phpintel-bench-')
+    try:
+        paths = corpus.generate(folder, options.files, options.classes, options.depth, options.methods, options.seed)
+        log('Generated {files:d} files in {folder}'.format(files=len(paths), folder=folder))
+
+        results = {}
+        declarations = bench_parser(results, paths)
+        bench_index(results, declarations)
+        for backend in stores:
+            bench_store(results, backend, folder, declarations)
+        bench_completion(results, folder, options.depth, options.repeat)
+        bench_project_scan(results, stores[0], folder, paths, options.batch_size, workers)
+    finally:
+        phpparser.close_worker()
+        if options.keep:
+            log('Kept corpus in ' + folder)
+        else:
+            shutil.rmtree(folder, True)
+
+    output = {
+        'version': RESULTS_VERSION,
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'tokenizer': options.tokenizer,
+        'workers': workers,
+        'corpus': {
+            'files': options.files,
+            'classes': options.classes,
+            'depth': options.depth,
+            'methods': options.methods,
+            'seed': options.seed,
+            'declarations': sum([len(d) for d in declarations.values()]),
+        },
+        'results': results,
+    }
+
+    if options.output:
+        with open(options.output, 'w') as f:
+            json.dump(output, f, indent=2, sort_keys=True)
+    else:
+        json.dump(output, sys.stdout, indent=2, sort_keys=True)
+        sys.stdout.write('\n')
+
+    if options.compare:
+        if compare(results, options.compare, options.threshold):
+            return 1
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,90 @@
+'''
+Stand-in for Sublime Text's sublime module so that the plugin can be
+imported and benchmarked from a plain Python interpreter. Only the parts
+of the API used by SublimePHPIntel are provided.
+'''
+
+ENCODED_POSITION = 1
+TRANSIENT = 4
+
+
+class Settings(dict):
+    def get(self, key, default=None):
+        return dict.get(self, key, default)
+
+    def set(self, key, value):
+        self[key] = value
+
+    def add_on_change(self, key, callback):
+        pass
+
+    def clear_on_change(self, key):
+        pass
+
+
+class Region(object):
+    def __init__(self, a, b):
+        self.a = a
+        self.b = b
+
+    def begin(self):
+        return min(self.a, self.b)
+
+    def end(self):
+        return max(self.a, self.b)
+
+
+class View(object):
+    def __init__(self, text=''):
+        self.text = text
+        self._change_count = 0
+
+    def id(self):
+        return id(self)
+
+    def size(self):
+        return len(self.text)
+
+    def substr(self, region):
+        return self.text[region.begin():region.end()]
+
+    def change_count(self):
+        return self._change_count
+
+
+class Window(object):
+    def __init__(self):
+        self._folders = []
+
+    def folders(self):
+        return self._folders
+
+
+_settings = {}
+_window = Window()
+
+
+def load_settings(name):
+    if name not in _settings:
+        _settings[name] = Settings()
+    return _settings[name]
+
+
+def active_window():
+    return _window
+
+
+def windows():
+    return [_window]
+
+
+def set_timeout(callback, delay):
+    callback()
+
+
+def status_message(message):
+    pass
+
+
+def error_message(message):
+    pass
@@ -0,0 +1,21 @@
+'''
+Stand-in for Sublime Text's sublime_plugin module. See sublime.py.
+'''
+
+
+class ApplicationCommand(object):
+    pass
+
+
+class WindowCommand(object):
+    def __init__(self, window=None):
+        self.window = window
+
+
+class TextCommand(object):
+    def __init__(self, view=None):
+        self.view = view
+
+
+class EventListener(object):
+    pass
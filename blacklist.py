@@ -0,0 +1,228 @@
+'''
+SublimePHPIntel for Sublime Text 2
+Copyright 2012 John Watson <https://github.com/jotson>
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights to
+use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of
+the Software, and to permit persons to whom the Software is furnished to do so,
+subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+'''
+
+
+import os
+import re
+
+# Characters that make a blacklist entry a pattern rather than a plain
+# string to look for in the path
+GLOB_CHARS = '*?['
+
+
+class Blacklist(object):
+    '''
+    The scan_blacklist entries of a project folder, compiled once.
+
+    Entries without wildcards, such as "yii/messages", exclude every path
+    that contains them, as they always have. Other entries, and the lines of
+    the folder's .gitignore when gitignore is True, follow the rules of
+    .gitignore: "*", "?" and "[...]" match within a name and "**" across
+    folders, a "/" at the start or in the middle anchors the pattern to the
+    project folder, one at the end matches only folders, and "!" includes
+    again what an earlier pattern excluded. The .gitignore is read first, so
+    that entries in the settings can override it.
+
+    Excluded folders can be pruned from a walk with excludes_folder(),
+    without listing anything inside them.
+    '''
+    def __init__(self, patterns, root, gitignore=False):
+        self.root = root.rstrip(os.sep)
+        self.rules = []
+        substrings = []
+        if gitignore:
+            self.read_gitignore(os.path.join(self.root, '.gitignore'))
+        for pattern in patterns or []:
+            if not pattern:
+                continue
+            if pattern[0] in '/!' or [c for c in GLOB_CHARS if c in pattern]:
+                self.add_rule(pattern)
+            else:
+                substrings.append(re.escape(normalize(pattern)))
+
+        self.substrings = None
+        if substrings:
+            self.substrings = re.compile('|'.join(substrings))
+
+        # Most paths match no rule at all, which these find out in one go
+        self.any_file = None
+        self.any_folder = None
+        if self.rules:
+            self.any_folder = re.compile('|'.join([regex.pattern for regex, negate, folder_only in self.rules]))
+            file_rules = [regex.pattern for regex, negate, folder_only in self.rules if not folder_only]
+            if file_rules:
+                self.any_file = re.compile('|'.join(file_rules))
+
+    def read_gitignore(self, filename):
+        try:
+            with open(filename) as f:
+                lines = f.read().splitlines()
+        except IOError:
+            return
+        for line in lines:
+            line = line.rstrip()
+            if line and not line.startswith('#'):
+                self.add_rule(line)
+
+    def add_rule(self, pattern):
+        negate = pattern.startswith('!')
+        if negate:
+            pattern = pattern[1:]
+        elif pattern.startswith('\\!') or pattern.startswith('\\#'):
+            pattern = pattern[1:]
+        folder_only = pattern.endswith('/')
+        pattern = pattern.rstrip('/')
+        if pattern:
+            self.rules.append((re.compile(translate(pattern)), negate, folder_only))
+
+    def relative(self, path):
+        '''
+        Return path relative to the project folder and separated by '/', or
+        None if it is not below the project folder
+        '''
+        if not path.startswith(self.root + os.sep):
+            return None
+        return normalize(path[len(self.root) + 1:])
+
+    def match_rules(self, relative, folder):
+        any_match = self.any_folder if folder else self.any_file
+        if any_match == None or relative == None or not any_match.search(relative):
+            return False
+        for regex, negate, folder_only in reversed(self.rules):
+            if folder_only and not folder:
+                continue
+            if regex.search(relative):
+                return not negate
+        return False
+
+    def excludes_file(self, path):
+        '''
+        Returns True if the file is excluded by name. The folders it is in
+        are not checked, see excludes().
+        '''
+        if self.substrings and self.substrings.search(normalize(path)):
+            return True
+        return self.match_rules(self.relative(path), False)
+
+    def excludes_folder(self, path):
+        '''
+        Returns True if everything in the folder is excluded. The folders it
+        is in are not checked.
+        '''
+        if self.substrings and self.substrings.search(normalize(path) + '/'):
+            return True
+        return self.match_rules(self.relative(path), True)
+
+    def excludes(self, path):
+        '''
+        Returns True if the file, or any folder it is in, is excluded
+        '''
+        if self.excludes_file(path):
+            return True
+        relative = self.relative(path)
+        if relative == None:
+            return False
+        parts = relative.split('/')
+        for i in range(1, len(parts)):
+            if self.match_rules('/'.join(parts[:i]), True):
+                return True
+        return False
+
+    __call__ = excludes
+
+
+def normalize(path):
+    if os.sep != '/':
+        path = path.replace(os.sep, '/')
+    return path
+
+
+def translate(pattern):
+    '''
+    Return a regular expression for a .gitignore pattern, without its "!"
+    and trailing "/", that matches paths relative to the project folder
+    '''
+    anchored = '/' in pattern
+    pattern = pattern.lstrip('/')
+    regex = []
+    i = 0
+    n = len(pattern)
+    while i < n:
+        c = pattern[i]
+        at_start = i == 0 or pattern[i - 1] == '/'
+        if at_start and pattern.startswith('**/', i):
+            regex.append('(?:.*/)?')
+            i += 3
+        elif at_start and pattern.startswith('**', i) and i + 2 == n:
+            regex.append('.*')
+            i += 2
+        elif c == '*':
+            regex.append('[^/]*')
+            i += 1
+        elif c == '?':
+            regex.append('[^/]')
+            i += 1
+        elif c == '[':
+            end = pattern.find(']', i + 2)
+            if end < 0:
+                regex.append('\\[')
+                i += 1
+            else:
+                chars = pattern[i + 1:end]
+                if chars[0] == '!':
+                    chars = '^' + chars[1:]
+                regex.append('[' + chars.replace('\\', '\\\\') + ']')
+                i = end + 1
+        elif c == '\\' and i + 1 < n:
+            regex.append(re.escape(pattern[i + 1]))
+            i += 2
+        else:
+            regex.append(re.escape(c))
+            i += 1
+
+    if anchored:
+        return '^' + ''.join(regex) + '$'
+    return '(?:^|/)' + ''.join(regex) + '$'
+
+
+def for_folders(patterns, folders, gitignore=False):
+    '''
+    Return excludes(path) and excludes_folder(path) functions that apply the
+    Blacklist of whichever of folders path is in
+    '''
+    blacklists = [(folder.rstrip(os.sep) + os.sep, Blacklist(patterns, folder, gitignore)) for folder in folders]
+
+    def find(path):
+        for prefix, b in blacklists:
+            if path.startswith(prefix):
+                return b
+
+    def excludes(path):
+        b = find(path)
+        return b != None and b.excludes(path)
+
+    def excludes_folder(path):
+        b = find(path)
+        return b != None and b.excludes_folder(path)
+
+    return excludes, excludes_folder
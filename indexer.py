@@ -0,0 +1,208 @@
+'''
+SublimePHPIntel for Sublime Text 2
+Copyright 2012 John Watson <https://github.com/jotson>
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights to
+use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of
+the Software, and to permit persons to whom the Software is furnished to do so,
+subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+'''
+
+'''
+Command line indexer. Builds the same .phpintel folder as the Scan Project
+command, so that projects can be indexed ahead of time, for example on a
+build server:
+
+    python indexer.py /path/to/project
+
+Files are tokenized and converted by a pool of worker processes while the
+main process writes the results to the intel store. Files that haven't
+changed since the last scan are skipped, so the indexer can be run again
+to bring an existing .phpintel folder up to date.
+'''
+
+import os
+import re
+import sys
+import json
+import time
+import signal
+from optparse import OptionParser
+import phpparser
+import intel
+import blacklist
+
+# Strings, which are kept, and comments and trailing commas, which are
+# removed, in a .sublime-settings file
+_settings_re = re.compile(r'("(?:[^"\\]|\\.)*")|/\*.*?\*/|//[^\n]*|,(?=\s*[\]}])', re.S)
+
+
+def load_settings(filenames):
+    '''
+    Read .sublime-settings files, which are JSON with comments, and merge
+    them in order
+    '''
+    settings = {}
+    for filename in filenames:
+        with open(filename) as f:
+            text = f.read()
+        settings.update(json.loads(_settings_re.sub(lambda m: m.group(1) or '', text)))
+
+    return settings
+
+
+def init_worker(tokenizer):
+    # Leave ^C to the main process, which stops the pool
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    phpparser.set_tokenizer(tokenizer)
+
+
+def scan_batch(batch):
+    '''
+    Scan a batch of files in a worker process
+    '''
+    return list(phpparser.scan_files(batch))
+
+
+def index_folder(folder, patterns, workers, batch_size, tokenizer, full=False, log=None, gitignore=False):
+    '''
+    Bring the intel for folder up to date, skipping files excluded by the
+    blacklist patterns. Returns the number of files scanned, skipped
+    because they hadn't changed and removed.
+    '''
+    excluded = blacklist.Blacklist(patterns, folder, gitignore)
+
+    index = intel.FolderIndex(folder)
+    manifest = intel.load_manifest(folder)
+    pending = {}
+    seen = set()
+    counts = {'scanned': 0, 'skipped': 0, 'removed': 0}
+
+    def changed_files():
+        for path in phpparser.find_files(folder, exclude=excluded.excludes_file, exclude_folder=excluded.excludes_folder):
+            seen.add(path)
+            try:
+                signature, changed = intel.get_signature(path, {} if full else manifest)
+            except (IOError, OSError):
+                continue
+            if changed:
+                pending[path] = signature
+                yield path
+            else:
+                manifest[path] = signature
+                counts['skipped'] += 1
+
+    def batches():
+        batch = []
+        for path in changed_files():
+            batch.append(path)
+            if len(batch) >= batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    if workers > 1:
+        import multiprocessing
+        pool = multiprocessing.Pool(workers, init_worker, (tokenizer,))
+        results = pool.imap_unordered(scan_batch, batches())
+    else:
+        pool = None
+        phpparser.set_tokenizer(tokenizer)
+        results = (list(phpparser.scan_files(batch)) for batch in batches())
+
+    try:
+        for result in results:
+            for path, d in result:
+                if d:
+                    intel.save(d, folder, path)
+                else:
+                    intel.remove(folder, path)
+                index.update(path, *set([x.class_name for x in d]))
+                manifest[path] = pending.pop(path)
+                counts['scanned'] += 1
+                if log:
+                    log(path)
+            intel.commit(folder)
+    finally:
+        if pool:
+            pool.terminate()
+            pool.join()
+        phpparser.close_worker()
+
+    # Forget files that were deleted or blacklisted since the last scan,
+    # including those indexed without a manifest entry
+    for path in set(manifest.keys()) | set(index.paths()):
+        if path not in seen:
+            intel.remove(folder, path)
+            index.update(path)
+            manifest.pop(path, None)
+            counts['removed'] += 1
+
+    index.save()
+    intel.save_manifest(folder, manifest)
+
+    return counts
+
+
+def main():
+    package_folder = os.path.dirname(os.path.abspath(__file__))
+
+    parser = OptionParser(usage='%prog [options] FOLDER...', description='Build or update the .phpintel index of each FOLDER.')
+    parser.add_option('-j', '--workers', type='int', default=0, help='number of worker processes, 0 for one per CPU')
+    parser.add_option('--batch-size', type='int', help='files handed to a worker at a time')
+    parser.add_option('--tokenizer', help="'php' or 'python'")
+    parser.add_option('--store', help="'sqlite' or 'files'")
+    parser.add_option('--settings', action='append', default=[], metavar='FILE', help='read scan_blacklist and the other settings from FILE, after the package defaults; may be repeated')
+    parser.add_option('--blacklist', action='append', default=[], metavar='PATH', help='also skip paths containing PATH, or matching it if it is a .gitignore style pattern; may be repeated')
+    parser.add_option('--gitignore', action='store_true', help="also skip files ignored by each FOLDER's .gitignore")
+    parser.add_option('--full', action='store_true', help='scan every file, even if it has not changed')
+    parser.add_option('-v', '--verbose', action='store_true', help='print the path of every scanned file')
+    options, folders = parser.parse_args()
+
+    if not folders:
+        parser.error('no folder given')
+
+    settings = load_settings([os.path.join(package_folder, 'SublimePHPIntel.sublime-settings')] + options.settings)
+    patterns = (settings.get('scan_blacklist') or []) + options.blacklist
+    gitignore = options.gitignore or settings.get('scan_gitignore', False)
+    tokenizer = options.tokenizer or settings.get('tokenizer', 'php')
+    batch_size = options.batch_size or settings.get('scan_batch_size', 100)
+    workers = options.workers or settings.get('scan_workers', 0)
+    if workers < 1:
+        try:
+            import multiprocessing
+            workers = multiprocessing.cpu_count()
+        except (ImportError, NotImplementedError):
+            workers = 1
+
+    intel.set_store_backend(options.store or settings.get('intel_store', 'sqlite'))
+
+    log = None
+    if options.verbose:
+        log = lambda path: sys.stderr.write(path + '\n')
+
+    for folder in folders:
+        folder = os.path.abspath(folder)
+        start_time = time.time()
+        counts = index_folder(folder, patterns, workers, batch_size, tokenizer, options.full, log, gitignore)
+        sys.stderr.write('{folder}: {scanned:d} files scanned, {skipped:d} unchanged, {removed:d} removed in {elapsed:.2f}s\n'.format(folder=folder, elapsed=time.time() - start_time, **counts))
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -28,18 +28,89 @@ SOFTWARE.
 '''
 
 import os
+import re
+import bisect
 import hashlib
 import pickle
+import threading
+import phpparser
 
+try:
+    import sqlite3
+except ImportError:
+    sqlite3 = None
+
+# Bump when the format of saved declarations changes so that the next
+# project scan re-reads every file.
+MANIFEST_VERSION = 3
+
+# class name -> set of files declaring it, and the reverse
 _index = {}
+_files = {}
+_class_prefix_index = None
+# class name -> MemberTable, and class name -> classes that inherit from it
+_members = {}
+_children = {}
 _roots = []
+_loaded = None
+_generation = 0
+_cache = None
+# root -> files saved or removed since the last commit to root
+_uncommitted = {}
+# Guards the resident index, which completions read while scans update it
+_lock = threading.RLock()
+_stores = {}
+_stores_lock = threading.Lock()
+_store_backend = 'sqlite' if sqlite3 else 'files'
 
 
 def reset():
     global _index
+    global _files
     global _roots
-    _index = {}
-    _roots = []
+    global _loaded
+    global _generation
+    global _class_prefix_index
+    global _members
+    global _children
+    with _lock:
+        _index = {}
+        _files = {}
+        _members = {}
+        _children = {}
+        _roots = []
+        _loaded = None
+        _generation += 1
+        _class_prefix_index = None
+
+
+def generation():
+    '''
+    Return a number that changes whenever the resident index does
+    '''
+    return _generation
+
+
+def load_indexes(roots):
+    '''
+    Make the resident index hold the indexes for roots. The indexes are only
+    reloaded when the roots change or when the index in a store was changed
+    by another process. Scans in this process update the resident index in
+    place.
+    '''
+    global _loaded
+
+    with _lock:
+        key = (tuple(roots), tuple([get_store(root).get_stamp() for root in roots]))
+        if key != _loaded:
+            if _loaded and _loaded[0] == key[0]:
+                # Another process changed a store, so cached declarations may
+                # be stale too
+                _cache.clear()
+            reset()
+            for root in roots:
+                load_index(root)
+            _loaded = key
 
 
 def get_intel_folder(root):
@@ -53,55 +124,76 @@ def get_intel_folder(root):
     return folder
 
 
-def get_intel_path(root, filename):
+def update_index(filename, *classes):
     '''
-    Return full path to an intel file
+    Replace the classes recorded for filename in the index
     '''
-    folder = get_intel_folder(root)
-    if folder:
-        hashed_filename = hashlib.md5(filename).hexdigest()
-        return os.path.join(folder, hashed_filename)
-
-    return None
+    global _class_prefix_index, _generation
 
+    with _lock:
+        old_classes, names, renamed = set_classes(_index, _files, filename, classes)
+        if renamed:
+            _class_prefix_index = None
+        _generation += 1
 
-def update_index(filename, *classes):
-    global _index
+        invalidate_members(*(old_classes | names))
 
-    if _index == None:
-        load_index()
 
-    for key in _index.keys():
-        if filename in _index[key]:
-            _index[key].remove(filename)
+def set_classes(index, files, filename, classes):
+    '''
+    Replace the classes recorded for filename in index, which maps class
+    names to files, and in files, which maps files to class names. Returns
+    the old and the new class names of filename and whether a class name
+    was added to or dropped from index.
+    '''
+    renamed = False
+    old_classes = files.pop(filename, set())
+    for classname in old_classes:
+        paths = index.get(classname)
+        if paths != None:
+            paths.discard(filename)
+            if not paths:
+                del index[classname]
+                renamed = True
 
+    names = set()
     for classname in classes:
         if classname == None:
             classname = '__global__'
-        if classname not in _index.keys():
-            _index[classname] = [filename]
-        elif filename not in _index[classname]:
-            _index[classname].append(filename)
+        names.add(classname)
+        if classname in index:
+            index[classname].add(filename)
+        else:
+            index[classname] = set([filename])
+            renamed = True
+    if names:
+        files[filename] = names
+
+    return set(old_classes), names, renamed
 
 
 def load_index(root):
     '''
     Load the index located in root
     '''
-    global _index, _roots
+    global _index, _roots, _class_prefix_index
 
-    folder = get_intel_folder(root)
-    index_filename = os.path.join(folder, 'index')
-    if folder and os.path.exists(index_filename):
-        with open(index_filename, 'rb') as f:
-            t = pickle.load(f)
-            if '__global__' in _index:
-                if '__global__' in t:
-                    t['__global__'].extend(_index['__global__'])
+    with _lock:
+        _class_prefix_index = None
+        _members.clear()
+        _children.clear()
+        t = get_store(root).load_index()
+        if t != None:
+            for classname, files in t.iteritems():
+                if classname in _index:
+                    _index[classname].update(files)
                 else:
-                    t['__global__'] = _index['__global__']
-                t['__global__'] = list(set(t['__global__']))
-            _index.update(t)
+                    _index[classname] = set(files)
+                for filename in files:
+                    if filename in _files:
+                        _files[filename].add(classname)
+                    else:
+                        _files[filename] = set([classname])
 
             if root not in _roots:
                 _roots.append(root)
@@ -119,7 +211,7 @@ def get_class(context):
         return None, None
 
     if len(context) == 1:
-        if context[0] in _index.keys():
+        if context[0] in _index:
             return context[0], ''
 
         return '__global__', context[0]
@@ -131,97 +223,930 @@ def get_class(context):
         return context[0], context[1]
 
     # Determine the class of context[1] and recurse
-    intel = get_intel(context[0])
-    for i in intel:
-        if i['name'] == context[1] or i['name'] == '$' + context[1]:
-            if i['returns']:
-                context[1] = i['returns']
-                return get_class(context[1:])
-
-    # Didn't find class of context[1] so try again starting from the class
-    # that context[0] extends
-    for i in intel:
-        if i['class'] == context[0] and i['extends']:
-            context[0] = i['extends']
-            return get_class(context)
+    member = get_members(context[0]).get(context[1])
+    if member and member.returns:
+        context[1] = member.returns
+        return get_class(context[1:])
 
     return context[0], context[1]
 
 
 def get_intel(class_name):
-    intel = []
-
-    if class_name in _index:
-        for filename in _index[class_name]:
-            for root in _roots:
-                intel.extend(load(root, filename))
-
-    return intel
-
-
-def find_completions(context, operator, context_class, context_partial, found, match_visibility='public', parsed=[]):
-    if context_class in parsed:
-        return
-
-    # Match class names
-    if context_class == '__global__':
-        for i in _index:
-            if i.lower().startswith(context_partial.lower()):
-                found.append(
-                    {
-                        'class': i,
-                        'name': i,
-                        'kind': 'class',
-                        'args': [],
-                        'returns': i
-                    }
-                )
-
-    # Match member names
-    if context_class in _index:
-        intel = get_intel(context_class)
-        for i in intel:
-            if not context_class in parsed:
-                parsed.append(context_class)
-                if i['extends']:
-                    find_completions(context, operator, i['extends'], context_partial, found, match_visibility, parsed)
-            if i['name'] and i['name'].lower().startswith(context_partial.lower()):
-                match_static = 0
-                if operator == '::':
-                    match_static = 1
-                if int(i['static']) == int(match_static) and (i['visibility'] == match_visibility or match_visibility == 'all'):
+    with _lock:
+        intel = []
+
+        if class_name in _index:
+            for filename in _index[class_name]:
+                for root in _roots:
+                    intel.extend(load(root, filename))
+
+        return intel
+
+
+def find_classes(prefix):
+    '''
+    Return the names of all indexed classes that start with prefix, ignoring
+    case
+    '''
+    global _class_prefix_index
+
+    with _lock:
+        if _class_prefix_index == None:
+            _class_prefix_index = PrefixIndex([(name, name) for name in _index])
+
+        return _class_prefix_index.find(prefix)
+
+
+class PrefixIndex(object):
+    '''
+    Case-insensitive prefix search over a fixed set of (name, value) pairs.
+    The names are kept sorted so a search is a binary search for the first
+    match followed by a walk over the matches.
+    '''
+    def __init__(self, items):
+        items = sorted([(name.lower(), value) for name, value in items], key=lambda item: item[0])
+        self.keys = [key for key, value in items]
+        self.values = [value for key, value in items]
+
+    def find(self, prefix):
+        '''
+        Return the values of all names that start with prefix
+        '''
+        prefix = prefix.lower()
+        start = bisect.bisect_left(self.keys, prefix)
+        end = start
+        while end < len(self.keys) and self.keys[end].startswith(prefix):
+            end += 1
+
+        return self.values[start:end]
+
+
+def find_completions(context, operator, context_class, context_partial, found, match_visibility='public'):
+    with _lock:
+        # Match class names
+        if context_class == '__global__':
+            for i in find_classes(context_partial):
+                found.append(phpparser.Declaration(i, kind='class', name=i, returns=i))
+
+        # Match member names
+        if context_class in _index:
+            match_static = operator == '::'
+            for i in get_members(context_class).find(context_partial):
+                if i.static == match_static and (i.visibility == match_visibility or match_visibility == 'all'):
                     found.append(i)
 
 
-def save_index(root):
+def get_members(class_name):
+    '''
+    Return the MemberTable for class_name, building it if needed
+    '''
+    with _lock:
+        table = _members.get(class_name)
+        if table == None:
+            table = build_members(class_name, set())
+
+        return table
+
+
+def build_members(class_name, building):
+    '''
+    Build and cache the member table for class_name from its own
+    declarations and the tables of the classes and interfaces it extends or
+    implements. building holds the classes already being built further down
+    the stack so that circular inheritance terminates.
+    '''
+    building.add(class_name)
+
+    members = []
+    keys = set()
+    parents = []
+    for i in get_intel(class_name):
+        if i.class_name != class_name:
+            continue
+        for parent in [i.extends] + i.implements.split(','):
+            parent = parent.strip()
+            if parent and parent not in parents:
+                parents.append(parent)
+        if i.name and (i.kind, i.name) not in keys:
+            keys.add((i.kind, i.name))
+            members.append(i)
+
+    for parent in parents:
+        if parent in building:
+            continue
+        _children.setdefault(parent, set()).add(class_name)
+        table = _members.get(parent)
+        if table == None:
+            table = build_members(parent, building)
+        for i in table.members:
+            # Private members are not inherited and the nearest declaration
+            # of a member overrides the rest
+            if i.visibility != 'private' and (i.kind, i.name) not in keys:
+                keys.add((i.kind, i.name))
+                members.append(i)
+
+    table = MemberTable(members)
+    _members[class_name] = table
+    building.discard(class_name)
+
+    return table
+
+
+def invalidate_members(*classes):
+    '''
+    Drop the member tables of classes and of every class that inherits from
+    them
+    '''
+    pending = list(classes)
+    while pending:
+        class_name = pending.pop()
+        _members.pop(class_name, None)
+        pending.extend(_children.pop(class_name, ()))
+
+
+class MemberTable(object):
     '''
-    Save the index to root
+    All members of a class, including inherited ones, with lookups by exact
+    name and by case-insensitive prefix.
     '''
-    folder = get_intel_folder(root)
-    index_filename = os.path.join(folder, 'index')
-    if folder:
-        with open(index_filename, 'wb') as f:
-            pickle.dump(_index, f, pickle.HIGHEST_PROTOCOL)
-    
+    def __init__(self, members):
+        self.members = members
+        self.names = {}
+        for i in members:
+            if i.name not in self.names:
+                self.names[i.name] = i
+        self.prefix_index = PrefixIndex([(i.name, i) for i in members])
+
+    def get(self, name):
+        '''
+        Return the member called name or $name
+        '''
+        return self.names.get(name) or self.names.get('$' + name)
+
+    def find(self, prefix):
+        return self.prefix_index.find(prefix)
+
+
+class FolderIndex(object):
+    '''
+    The class index of a single root, as updated by a scan of it. Changes
+    are made to the resident index too when root is one of the loaded
+    roots, so that the resident index never has to be reloaded after a
+    scan.
+    '''
+    def __init__(self, root):
+        self.root = root
+        self.store = get_store(root)
+        self.index = None
+        self.files = None
+
+    def load(self):
+        '''
+        Read the index from the store, the first time it is needed
+        '''
+        if self.index != None:
+            return
+        self.index = {}
+        self.files = {}
+        t = self.store.load_index()
+        if t != None:
+            for classname, files in t.iteritems():
+                self.index[classname] = set(files)
+                for filename in files:
+                    if filename in self.files:
+                        self.files[filename].add(classname)
+                    else:
+                        self.files[filename] = set([classname])
+
+    def paths(self):
+        '''
+        Return the files that have classes in the index
+        '''
+        self.load()
+        return self.files.keys()
+
+    def update(self, filename, *classes):
+        '''
+        Replace the classes recorded for filename
+        '''
+        if self.store.keeps_index:
+            self.load()
+            set_classes(self.index, self.files, filename, classes)
+        with _lock:
+            if self.root in _roots:
+                update_index(filename, *classes)
+
+    def save(self):
+        '''
+        Save the index to root. The resident index is already up to date, so
+        the new stamp of the store is recorded to keep load_indexes() from
+        reloading it.
+        '''
+        global _loaded
+        if self.store.keeps_index:
+            self.load()
+        self.store.save_index(self.index)
+        committed(self.root)
+        with _lock:
+            if _loaded and self.root in _loaded[0]:
+                stamps = list(_loaded[1])
+                stamps[_loaded[0].index(self.root)] = self.store.get_stamp()
+                _loaded = (_loaded[0], tuple(stamps))
+
 
 def save(declarations, root, filename):
     '''
     Save declarations for filename to root
     '''
-    intel_filename = get_intel_path(root, filename)
-    with open(intel_filename, 'wb') as f:
-        pickle.dump(declarations, f, pickle.HIGHEST_PROTOCOL)
+    get_store(root).save(filename, declarations)
+    forget(root, filename)
 
 
 def load(root, filename):
     '''
-    Load declarations for filename in root
+    Load declarations for filename in root. Recently used declarations are
+    kept in memory.
     '''
-    declarations = []
-    
-    intel_filename = get_intel_path(root, filename)
-    if os.path.exists(intel_filename):
-        with open(intel_filename, 'rb') as f:
-            declarations = pickle.load(f)
+    key = (root, filename)
+    declarations = _cache.get(key)
+    if declarations == None:
+        declarations = get_store(root).load(filename)
+        _cache.put(key, declarations, len(declarations) + 1)
 
     return declarations
+
+
+def remove(root, filename):
+    '''
+    Remove the declarations saved for filename in root
+    '''
+    get_store(root).remove(filename)
+    forget(root, filename)
+
+
+def forget(root, filename):
+    '''
+    Drop the cached declarations of filename in root. Until the write is
+    committed other threads still read the old declarations from the store,
+    so they are dropped again by committed().
+    '''
+    with _lock:
+        _cache.discard((root, filename))
+        _uncommitted.setdefault(root, set()).add(filename)
+
+
+def committed(root):
+    '''
+    Called once writes to root are committed. Drops the declarations that
+    were read from the store and cached while the writes were pending, and
+    the member tables built from them.
+    '''
+    with _lock:
+        classes = set()
+        for filename in _uncommitted.pop(root, ()):
+            _cache.discard((root, filename))
+            classes.update(_files.get(filename, ()))
+        invalidate_members(*classes)
+
+
+def set_cache_size(size):
+    '''
+    Set how many declarations may be kept in memory by load()
+    '''
+    _cache.resize(size)
+
+
+def cache_stats():
+    '''
+    Return hit and miss counts and the current size of the declaration
+    cache
+    '''
+    return _cache.stats()
+
+
+class LRUCache(object):
+    '''
+    A thread-safe least recently used cache bounded by the total size of its
+    values rather than the number of entries.
+
+    Entries are kept in a circular doubly linked list, most recently used
+    first. Each link is [previous, next, key, value, size].
+    '''
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.lock = threading.Lock()
+        self.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def clear(self):
+        with self.lock:
+            self.links = {}
+            self.head = []
+            self.head[:] = [self.head, self.head, None, None, 0]
+            self.size = 0
+
+    def get(self, key):
+        with self.lock:
+            link = self.links.get(key)
+            if link == None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.unlink(link)
+            self.link_first(link)
+            return link[3]
+
+    def put(self, key, value, size=1):
+        with self.lock:
+            link = self.links.pop(key, None)
+            if link:
+                self.unlink(link)
+                self.size -= link[4]
+            if size > self.capacity:
+                return
+            link = [None, None, key, value, size]
+            self.link_first(link)
+            self.links[key] = link
+            self.size += size
+            self.evict()
+
+    def discard(self, key):
+        with self.lock:
+            link = self.links.pop(key, None)
+            if link:
+                self.unlink(link)
+                self.size -= link[4]
+
+    def resize(self, capacity):
+        with self.lock:
+            self.capacity = capacity
+            self.evict()
+
+    def stats(self):
+        with self.lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'entries': len(self.links),
+                'size': self.size,
+                'capacity': self.capacity,
+            }
+
+    def evict(self):
+        while self.size > self.capacity:
+            link = self.head[0]
+            self.unlink(link)
+            del self.links[link[2]]
+            self.size -= link[4]
+
+    def unlink(self, link):
+        link[0][1] = link[1]
+        link[1][0] = link[0]
+
+    def link_first(self, link):
+        first = self.head[1]
+        link[0] = self.head
+        link[1] = first
+        first[0] = link
+        self.head[1] = link
+
+
+def commit(root):
+    '''
+    Make pending writes to root durable
+    '''
+    get_store(root).commit()
+    committed(root)
+
+
+def load_manifest(root):
+    '''
+    Load the scan manifest located in root. The manifest maps each scanned
+    path to its (mtime, size, hash) at the time it was scanned.
+    '''
+    return get_store(root).load_manifest()
+
+
+def load_signatures(root, paths):
+    '''
+    Load the manifest entries of only the given paths in root. Paths
+    without an entry are left out.
+    '''
+    return get_store(root).load_signatures(paths)
+
+
+def save_manifest(root, manifest):
+    '''
+    Save the scan manifest to root
+    '''
+    get_store(root).save_manifest(manifest)
+
+
+def update_manifest(root, entries):
+    '''
+    Update some of the manifest entries of root. entries maps each path to
+    its new signature, or to None to remove it from the manifest.
+    '''
+    get_store(root).update_manifest(entries)
+
+
+def get_signature(path, manifest):
+    '''
+    Return (mtime, size, hash) for path and whether it differs from the
+    entry in manifest. The file is only read and hashed when its mtime or
+    size no longer match the manifest.
+    '''
+    st = os.stat(path)
+    entry = manifest.get(path)
+    if entry and entry[0] == st.st_mtime and entry[1] == st.st_size:
+        return entry, False
+
+    with open(path, 'rb') as f:
+        digest = hashlib.md5(f.read()).hexdigest()
+    signature = (st.st_mtime, st.st_size, digest)
+    changed = not entry or entry[1] != st.st_size or entry[2] != digest
+
+    return signature, changed
+
+
+def find_symbol(name):
+    '''
+    Return (path, line, class, kind) for every declaration of a class,
+    function, method, property or constant called name in the loaded roots.
+    Classes come first.
+    '''
+    names = [name]
+    if not name.startswith('$'):
+        names.append('$' + name)
+
+    found = set()
+    for root in _roots:
+        found.update(get_store(root).find_symbol(names))
+
+    return sorted(found, key=lambda l: (l[3] != 'class', l[0], l[1]))
+
+
+def set_store_backend(name):
+    '''
+    Select how intel is stored in .phpintel: 'sqlite' keeps everything in a
+    single database file and 'files' writes one pickle per source file.
+    '''
+    global _store_backend
+    if name == 'sqlite' and sqlite3 == None:
+        print 'SublimePHPIntel: sqlite3 is not available, using the files store'
+        name = 'files'
+    if name not in ('sqlite', 'files'):
+        print 'SublimePHPIntel: Unknown intel store: ' + str(name)
+        name = 'files'
+    with _stores_lock:
+        if name != _store_backend:
+            _stores.clear()
+        _store_backend = name
+
+
+def get_store(root):
+    '''
+    Return the intel store for root
+    '''
+    with _stores_lock:
+        store = _stores.get(root)
+        if store == None:
+            if _store_backend == 'sqlite':
+                store = SqliteStore(root)
+            else:
+                store = FileStore(root)
+            _stores[root] = store
+
+    return store
+
+
+class FileStore(object):
+    '''
+    Stores the index, the manifest and one pickle of declarations per
+    source file in the intel folder.
+    '''
+    # save_index() writes out the whole index
+    keeps_index = True
+
+    def __init__(self, root):
+        self.root = root
+        self.folder = get_intel_folder(root)
+        self.lock = threading.RLock()
+        self.symbols = None
+        self.symbol_files = None
+        self.symbols_stamp = None
+        self.symbols_dirty = False
+        self.migrate()
+
+    def migrate(self):
+        '''
+        Rewrite intel that was saved with absolute paths as keys. The index
+        is rewritten last, so an interrupted migration is finished the next
+        time.
+        '''
+        index = self.read('index')
+        if not index:
+            return
+        filenames = set()
+        for files in index.values():
+            filenames.update([f for f in files if get_key(self.root, f) != f])
+        if not filenames:
+            return
+
+        for filename in filenames:
+            old = os.path.join(self.folder, hashlib.md5(encode_path(filename)).hexdigest())
+            if os.path.exists(old):
+                new = self.get_path(filename)
+                if os.path.exists(new):
+                    os.unlink(new)
+                os.rename(old, new)
+        symbols = self.read('symbols')
+        if symbols:
+            for name, locations in symbols.items():
+                symbols[name] = set([(get_key(self.root, l[0]),) + tuple(l[1:]) for l in locations])
+            self.write('symbols', symbols)
+        manifest = self.read('manifest')
+        if manifest:
+            manifest['files'] = dict([(get_key(self.root, path), signature) for path, signature in manifest['files'].items()])
+            self.write('manifest', manifest)
+        self.save_index(index)
+
+    def read(self, name):
+        '''
+        Return the contents of a pickle in the intel folder, or None
+        '''
+        filename = os.path.join(self.folder, name)
+        if os.path.exists(filename):
+            with open(filename, 'rb') as f:
+                return pickle.load(f)
+
+        return None
+
+    def write(self, name, value):
+        with open(os.path.join(self.folder, name), 'wb') as f:
+            pickle.dump(value, f, pickle.HIGHEST_PROTOCOL)
+
+    def get_path(self, filename):
+        '''
+        Return full path to an intel file
+        '''
+        return os.path.join(self.folder, hashlib.md5(encode_path(get_key(self.root, filename))).hexdigest())
+
+    def load_index(self):
+        index = self.read('index')
+        if index != None:
+            for classname, files in index.items():
+                index[classname] = set([get_path(self.root, f) for f in files])
+
+        return index
+
+    def save_index(self, index):
+        self.write('index', dict([(classname, set([get_key(self.root, f) for f in files])) for classname, files in index.iteritems()]))
+
+        with self.lock:
+            if self.symbols_dirty:
+                self.write('symbols', self.symbols)
+                self.symbols_stamp = self.get_stamp('symbols')
+                self.symbols_dirty = False
+
+    def get_stamp(self, name='index'):
+        try:
+            st = os.stat(os.path.join(self.folder, name))
+            return st.st_mtime, st.st_size
+        except OSError:
+            return None
+
+    def get_symbols(self):
+        '''
+        Return the symbol index, loading it if it changed on disk. Its
+        locations hold keys rather than paths.
+        '''
+        with self.lock:
+            if self.symbols_dirty:
+                return self.symbols
+            stamp = self.get_stamp('symbols')
+            if self.symbols == None or stamp != self.symbols_stamp:
+                self.symbols = {}
+                if stamp:
+                    with open(os.path.join(self.folder, 'symbols'), 'rb') as f:
+                        self.symbols = pickle.load(f)
+                self.symbol_files = {}
+                for name, locations in self.symbols.iteritems():
+                    for location in locations:
+                        self.symbol_files.setdefault(location[0], set()).add(name)
+                self.symbols_stamp = stamp
+
+            return self.symbols
+
+    def update_symbols(self, filename, declarations):
+        filename = get_key(self.root, filename)
+        with self.lock:
+            symbols = self.get_symbols()
+            for name in self.symbol_files.pop(filename, ()):
+                locations = symbols.get(name)
+                if locations:
+                    for location in [l for l in locations if l[0] == filename]:
+                        locations.remove(location)
+                    if not locations:
+                        del symbols[name]
+            names = set()
+            for name, location in get_symbols(filename, declarations):
+                symbols.setdefault(name, set()).add(location)
+                names.add(name)
+            if names:
+                self.symbol_files[filename] = names
+            self.symbols_dirty = True
+
+    def find_symbol(self, names):
+        with self.lock:
+            symbols = self.get_symbols()
+            found = []
+            for name in names:
+                found.extend([(get_path(self.root, l[0]),) + tuple(l[1:]) for l in symbols.get(name, ())])
+
+            return found
+
+    def save(self, filename, declarations):
+        with open(self.get_path(filename), 'wb') as f:
+            pickle.dump(relocate(declarations, get_key(self.root, filename)), f, pickle.HIGHEST_PROTOCOL)
+        self.update_symbols(filename, declarations)
+
+    def load(self, filename):
+        declarations = []
+
+        intel_filename = self.get_path(filename)
+        if os.path.exists(intel_filename):
+            with open(intel_filename, 'rb') as f:
+                declarations = relocate(phpparser.upgrade_declarations(pickle.load(f)), filename)
+
+        return declarations
+
+    def remove(self, filename):
+        intel_filename = self.get_path(filename)
+        if os.path.exists(intel_filename):
+            os.unlink(intel_filename)
+        self.update_symbols(filename, [])
+
+    def commit(self):
+        pass
+
+    def load_manifest(self):
+        manifest = {}
+
+        t = self.read('manifest')
+        if t and t.get('version') == MANIFEST_VERSION:
+            for key, signature in t['files'].iteritems():
+                manifest[get_path(self.root, key)] = signature
+
+        return manifest
+
+    def load_signatures(self, paths):
+        manifest = self.load_manifest()
+        return dict([(path, manifest[path]) for path in paths if path in manifest])
+
+    def save_manifest(self, manifest):
+        self.write('manifest', {'version': MANIFEST_VERSION, 'files': dict([(get_key(self.root, path), signature) for path, signature in manifest.iteritems()])})
+
+    def update_manifest(self, entries):
+        manifest = self.load_manifest()
+        for path, signature in entries.items():
+            if signature == None:
+                manifest.pop(path, None)
+            else:
+                manifest[path] = signature
+        self.save_manifest(manifest)
+
+
+class SqliteStore(object):
+    '''
+    Stores everything in a single SQLite database in the intel folder.
+
+    Declarations are keyed by their key (see get_key()) and the classes
+    table is indexed by
+    class name, so the class index is read straight from the database.
+    Writes are batched into a transaction that is committed by commit(),
+    save_index() and save_manifest(). Each thread gets its own connection.
+    '''
+    # The classes table is updated by save() and remove()
+    keeps_index = False
+
+    def __init__(self, root):
+        self.root = root
+        self.folder = get_intel_folder(root)
+        self.filename = os.path.join(self.folder, 'intel.db')
+        self.local = threading.local()
+
+        new = not os.path.exists(self.filename)
+        db = self.connect()
+        db.executescript('''
+            CREATE TABLE IF NOT EXISTS declarations (path TEXT PRIMARY KEY, data BLOB);
+            CREATE TABLE IF NOT EXISTS classes (class TEXT, path TEXT);
+            CREATE INDEX IF NOT EXISTS classes_class ON classes (class);
+            CREATE INDEX IF NOT EXISTS classes_path ON classes (path);
+            CREATE TABLE IF NOT EXISTS symbols (name TEXT, class TEXT, kind TEXT, path TEXT, line INTEGER);
+            CREATE INDEX IF NOT EXISTS symbols_name ON symbols (name);
+            CREATE INDEX IF NOT EXISTS symbols_path ON symbols (path);
+            CREATE TABLE IF NOT EXISTS files (path TEXT PRIMARY KEY, mtime REAL, size INTEGER, hash TEXT);
+            CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+        ''')
+        if new:
+            self.migrate()
+        self.migrate_paths()
+
+    def connect(self):
+        db = getattr(self.local, 'db', None)
+        if db == None:
+            db = sqlite3.connect(self.filename, timeout=30)
+            try:
+                db.execute('PRAGMA journal_mode=WAL')
+            except sqlite3.Error:
+                pass
+            self.local.db = db
+
+        return db
+
+    def migrate(self):
+        '''
+        Import intel written by the files store, then delete it.
+        '''
+        legacy = FileStore(os.path.dirname(self.folder))
+        index = legacy.load_index()
+        if index == None:
+            return
+
+        filenames = set()
+        for files in index.values():
+            filenames.update(files)
+        for filename in filenames:
+            declarations = legacy.load(filename)
+            if declarations:
+                self.save(filename, declarations)
+        self.save_manifest(legacy.load_manifest())
+
+        for name in os.listdir(self.folder):
+            if name in ('index', 'manifest') or re.match('^[0-9a-f]{32}$', name):
+                os.unlink(os.path.join(self.folder, name))
+
+    def migrate_paths(self):
+        '''
+        Replace the absolute paths that intel used to be saved under with
+        keys, once
+        '''
+        db = self.connect()
+        if db.execute("SELECT value FROM meta WHERE key = 'paths'").fetchone():
+            return
+        for table in ('declarations', 'classes', 'symbols', 'files'):
+            paths = [row[0] for row in db.execute('SELECT DISTINCT path FROM ' + table)]
+            db.executemany('UPDATE ' + table + ' SET path = ? WHERE path = ?', [(get_key(self.root, path), path) for path in paths if get_key(self.root, path) != path])
+        db.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('paths', 'relative')")
+        db.commit()
+
+    def load_index(self):
+        index = {}
+        for class_name, path in self.connect().execute('SELECT class, path FROM classes'):
+            path = get_path(self.root, path)
+            if class_name in index:
+                index[class_name].add(path)
+            else:
+                index[class_name] = set([path])
+
+        return index
+
+    def save_index(self, index):
+        db = self.connect()
+        db.execute("INSERT OR IGNORE INTO meta (key, value) VALUES ('generation', '0')")
+        db.execute("UPDATE meta SET value = value + 1 WHERE key = 'generation'")
+        db.commit()
+
+    def get_stamp(self):
+        row = self.connect().execute("SELECT value FROM meta WHERE key = 'generation'").fetchone()
+        return row[0] if row else None
+
+    def save(self, filename, declarations):
+        filename = get_key(self.root, filename)
+        db = self.connect()
+        db.execute('INSERT OR REPLACE INTO declarations (path, data) VALUES (?, ?)', (filename, sqlite3.Binary(pickle.dumps(relocate(declarations, filename), pickle.HIGHEST_PROTOCOL))))
+        db.execute('DELETE FROM classes WHERE path = ?', (filename,))
+        db.executemany('INSERT INTO classes (class, path) VALUES (?, ?)', [(c, filename) for c in set([d.class_name for d in declarations])])
+        db.execute('DELETE FROM symbols WHERE path = ?', (filename,))
+        db.executemany('INSERT INTO symbols (name, path, line, class, kind) VALUES (?, ?, ?, ?, ?)', [(name,) + location for name, location in get_symbols(filename, declarations)])
+
+    def load(self, filename):
+        row = self.connect().execute('SELECT data FROM declarations WHERE path = ?', (get_key(self.root, filename),)).fetchone()
+        if row:
+            return relocate(phpparser.upgrade_declarations(pickle.loads(str(row[0]))), filename)
+
+        return []
+
+    def remove(self, filename):
+        filename = get_key(self.root, filename)
+        db = self.connect()
+        db.execute('DELETE FROM declarations WHERE path = ?', (filename,))
+        db.execute('DELETE FROM classes WHERE path = ?', (filename,))
+        db.execute('DELETE FROM symbols WHERE path = ?', (filename,))
+
+    def find_symbol(self, names):
+        sql = 'SELECT path, line, class, kind FROM symbols WHERE name IN (' + ', '.join(['?'] * len(names)) + ')'
+        return [(get_path(self.root, row[0]),) + tuple(row[1:]) for row in self.connect().execute(sql, names)]
+
+    def commit(self):
+        self.connect().commit()
+
+    def load_manifest(self):
+        db = self.connect()
+        row = db.execute("SELECT value FROM meta WHERE key = 'manifest_version'").fetchone()
+        if not row or row[0] != str(MANIFEST_VERSION):
+            return {}
+
+        manifest = {}
+        for path, mtime, size, digest in db.execute('SELECT path, mtime, size, hash FROM files'):
+            manifest[get_path(self.root, path)] = (mtime, size, digest)
+
+        return manifest
+
+    def load_signatures(self, paths):
+        db = self.connect()
+        row = db.execute("SELECT value FROM meta WHERE key = 'manifest_version'").fetchone()
+        if not row or row[0] != str(MANIFEST_VERSION):
+            return {}
+
+        signatures = {}
+        keys = [get_key(self.root, path) for path in paths]
+        # Stay below SQLite's limit on the number of parameters
+        for i in range(0, len(keys), 500):
+            chunk = keys[i:i + 500]
+            sql = 'SELECT path, mtime, size, hash FROM files WHERE path IN (' + ', '.join(['?'] * len(chunk)) + ')'
+            for path, mtime, size, digest in db.execute(sql, chunk):
+                signatures[get_path(self.root, path)] = (mtime, size, digest)
+
+        return signatures
+
+    def save_manifest(self, manifest):
+        db = self.connect()
+        db.execute('DELETE FROM files')
+        db.executemany('INSERT INTO files (path, mtime, size, hash) VALUES (?, ?, ?, ?)', [(get_key(self.root, path), s[0], s[1], s[2]) for path, s in manifest.items()])
+        db.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('manifest_version', ?)", (str(MANIFEST_VERSION),))
+        db.commit()
+
+    def update_manifest(self, entries):
+        db = self.connect()
+        row = db.execute("SELECT value FROM meta WHERE key = 'manifest_version'").fetchone()
+        if not row or row[0] != str(MANIFEST_VERSION):
+            # As in the files store, entries of another version are dropped
+            db.execute('DELETE FROM files')
+            db.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('manifest_version', ?)", (str(MANIFEST_VERSION),))
+        db.executemany('DELETE FROM files WHERE path = ?', [(get_key(self.root, path),) for path, signature in entries.items() if signature == None])
+        db.executemany('INSERT OR REPLACE INTO files (path, mtime, size, hash) VALUES (?, ?, ?, ?)', [(get_key(self.root, path),) + tuple(signature) for path, signature in entries.items() if signature != None])
+        db.commit()
+
+
+def get_symbols(filename, declarations):
+    '''
+    Generates (name, (path, line, class, kind)) for each declared symbol
+    '''
+    for d in declarations:
+        if d.name:
+            yield d.name, (filename, d.line, d.class_name, d.kind)
+        elif d.class_name != '__global__':
+            yield d.class_name, (filename, d.line, d.class_name, 'class')
+
+
+def get_key(root, path):
+    '''
+    Return the key that intel for path is saved under in the store of root:
+    the path relative to root, with / as separator, so that intel built in
+    one checkout of a project can be used in another. Paths outside of
+    root are their own keys.
+    '''
+    prefix = os.path.join(root, '')
+    if path.startswith(prefix):
+        return path[len(prefix):].replace(os.sep, '/')
+    return path
+
+
+def get_path(root, key):
+    '''
+    Return the path saved under key in the store of root
+    '''
+    if os.path.isabs(key):
+        return key
+    return os.path.join(root, key.replace('/', os.sep))
+
+
+def relocate(declarations, path):
+    '''
+    Return declarations with path as the file they are declared in. The
+    stores save declarations with their key and load them with the path in
+    this checkout, which also fixes up those saved with absolute paths.
+    '''
+    return [d if d.path == path else d.replace(path=path) for d in declarations]
+
+
+def encode_path(path):
+    if isinstance(path, unicode):
+        return path.encode('utf-8')
+    return path
+
+
+_cache = LRUCache(50000)
@@ -22,13 +22,19 @@ SOFTWARE.
 '''
 
 import os
+import json
 import threading
 import time
+import Queue
 import re
 import sublime
 import sublime_plugin
 import phpparser
 import intel
+import timing
+import scheduler
+import blacklist
+import watcher
 
 '''
 TODO Detect variable assignment. e.g. $var = <code> where code returns an object
@@ -36,14 +42,12 @@ TODO Detect variable assignment. e.g. $var = <code> where code returns an object
 TODO Custom regex patterns for matching special cases, like factory methods.
      Mage::getModel('catalog/product'): e.g. {'Mage::getModel\('(.*?)/(.*?)'\)':
      'class': 'Mage_{1}_Model_{2}', 'cap_first': true}
-
-TODO Detect when new files are added/removed and rescan
 '''
 
 
 class ScanProjectCommand(sublime_plugin.WindowCommand):
     def run(self):
-        start_scan()
+        start_scan(folders=self.window.folders())
 
 
 class ScanAbortCommand(sublime_plugin.WindowCommand):
@@ -51,43 +55,84 @@ class ScanAbortCommand(sublime_plugin.WindowCommand):
         abort_scan()
 
 
+class ShowStatsCommand(sublime_plugin.WindowCommand):
+    '''
+    Show timing statistics, factory pattern timings, intel cache counts and
+    the scan queue in an output panel, and save them as stats.json in the .phpintel folder
+    of each project folder that has been scanned.
+    '''
+    def run(self):
+        phases = timing.stats()
+        stats = {
+            'timing_enabled': timing.is_enabled(),
+            'phases': phases,
+            'patterns': phpparser.get_pattern_timings(),
+            'cache': intel.cache_stats(),
+            'scan_queue': _scan_queue.stats(),
+        }
+
+        text = []
+        if not stats['timing_enabled']:
+            text.append('Timing is off. Set "timing" to true in the SublimePHPIntel settings to collect it.\n')
+        text.append(timing.report(phases))
+        text.append('\n{pattern:<60} {calls:>8} {total:>10} {max:>9}'.format(pattern='factory pattern', calls='calls', total='total ms', max='max ms'))
+        for pattern, (calls, total, slowest) in sorted(stats['patterns'].items()):
+            text.append('{pattern:<60} {calls:8d} {total:10.1f} {max:9.3f}'.format(pattern=pattern[:60], calls=calls, total=total * 1000, max=slowest * 1000))
+        text.append('\nintel cache: {hits:d} hits, {misses:d} misses, {entries:d} files, {size:d} of {capacity:d} declarations'.format(**stats['cache']))
+        queue = stats['scan_queue']
+        text.append('scan queue: {interactive:d} saved files, {background:d} changed files, project scan {project}, oldest waiting {oldest:.2f}s'.format(interactive=queue['queued'].get('interactive', 0), background=queue['queued'].get('background', 0), project='queued' if queue['project_scan_queued'] else 'not queued', oldest=queue['oldest_wait']))
+        for name, wait in sorted(queue['waits'].items()):
+            text.append('scan wait, {name}: {count:d} scans, mean {mean:.2f}s, max {max:.2f}s'.format(name=name, **wait))
+
+        for folder in self.window.folders():
+            # Creating .phpintel would make the folder look scanned
+            if not os.path.isdir(os.path.join(folder, '.phpintel')):
+                continue
+            filename = os.path.join(folder, '.phpintel', 'stats.json')
+            try:
+                with open(filename, 'w') as f:
+                    json.dump(stats, f, indent=2, sort_keys=True)
+                text.append('Saved to ' + filename)
+            except IOError as e:
+                text.append('Could not save {filename}: {error}'.format(filename=filename, error=e))
+
+        panel = self.window.get_output_panel('phpintel')
+        edit = panel.begin_edit()
+        panel.insert(edit, 0, '\n'.join(text) + '\n')
+        panel.end_edit(edit)
+        self.window.run_command('show_panel', {'panel': 'output.phpintel'})
+
+
 class GotoDeclarationCommand(sublime_plugin.TextCommand):
     def run(self, edit):
         if _scan_thread:
             return
 
-        intel.reset()
-
         view = self.view
         symbol = view.substr(expand_word(view, view.sel()[0]))
-        path = None
         if symbol:
-            for f in sublime.active_window().folders():
-                intel.load_index(f)
-            if symbol in intel._index:
-                # Find class
-                # TODO Show a quicklist when there is more than one choice
-                path = intel._index[symbol].pop()
-                self.view.window().open_file(path, sublime.TRANSIENT)
-            # elif symbol in intel._symbol_index:
-            #     # Find other symbol
-            #     # TODO Build an index (with line numbers) of all declared symbols to make this faster
-            #     # TODO Show a quicklist when there is more than one choice
-            #     path = intel._symbol_index[symbol].pop()
-            #     self.view.window().open_file(path, sublime.TRANSIENT)
-            #     # Proof of concept implementation:
-            #     # for class_name in intel._index.keys():
-            #     #     i = intel.get_intel(class_name)
-            #     #     for s in i:
-            #     #         if s['name'] == symbol:
-            #     #             path = intel._index[class_name].pop()
-            #     #             view = self.view.window().open_file(path, sublime.TRANSIENT)
-            #     #             break
+            intel.load_indexes(sublime.active_window().folders())
+            locations = intel.find_symbol(symbol)
+            if len(locations) == 1:
+                self.open(locations[0])
+            elif locations:
+                items = []
+                for path, line, class_name, kind in locations:
+                    if kind == 'class' or class_name == '__global__':
+                        caption = symbol
+                    else:
+                        caption = class_name + '::' + symbol
+                    items.append([caption, '{path}:{line}'.format(path=path, line=line)])
+                view.window().show_quick_panel(items, lambda i: self.open(locations[i]) if i >= 0 else None)
             else:
                 sublime.status_message('Not found')
         else:
             sublime.status_message('Put cursor on some text first')
 
+    def open(self, location):
+        path, line = location[0], location[1]
+        self.view.window().open_file('{path}:{line}'.format(path=path, line=line), sublime.ENCODED_POSITION | sublime.TRANSIENT)
+
 
 def expand_word(view, region):
     '''
@@ -103,80 +148,285 @@ def expand_word(view, region):
     return sublime.Region(start, end)
 
 
+class ClassSpanCache(object):
+    '''
+    Remembers where classes are declared in each view, so that $this can be
+    resolved with a lookup instead of parsing the whole buffer. Spans are
+    refreshed when the view's change count moves on, rescanning only around
+    the edit.
+    '''
+    def __init__(self):
+        self.views = {}
+
+    def class_at(self, view, source, point):
+        return self.find(view.id(), view.change_count(), source, point)
+
+    def find(self, view_id, change_count, source, point):
+        '''
+        As class_at(), for a view that is only known by its id and change
+        count, away from the UI thread
+        '''
+        entry = self.views.get(view_id)
+        if entry == None:
+            spans, checkpoints = phpparser.scan_class_spans(source)[:2]
+        elif entry[0] != change_count:
+            spans, checkpoints = phpparser.update_class_spans(entry[1], entry[2], entry[3], source)
+        else:
+            spans, checkpoints = entry[2], entry[3]
+        self.views[view_id] = (change_count, source, spans, checkpoints)
+
+        return phpparser.find_enclosing_class(spans, point, len(source))
+
+    def forget(self, view):
+        self.views.pop(view.id(), None)
+
+
+_class_spans = ClassSpanCache()
+
+
+class CompletionRequest(object):
+    '''
+    Completions wanted at a point in a view. Everything that needs the
+    Sublime API, which may only be used on the UI thread, is read when the
+    request is made, so that it can be computed on another thread.
+    '''
+    def __init__(self, view, source, point, prefix, folders):
+        self.view = view
+        self.view_id = view.id()
+        self.change_count = view.change_count()
+        self.source = source
+        self.point = point
+        self.prefix = prefix
+        self.word_start = point - len(prefix)
+        self.folders = folders
+        self.generation = intel.generation()
+        self.data = None
+        self.returned = None
+
+    def compute(self, cancelled=lambda: False):
+        '''
+        Find the completions and return them formatted for Sublime, or
+        None if cancelled() returned True in between steps
+        '''
+        found = []
+
+        # Find context
+        completion_started = timing.start()
+        started = timing.start()
+        context, visibility, operator = phpparser.get_context(self.source, self.point, lambda p: _class_spans.find(self.view_id, self.change_count, self.source, p))
+        timing.stop('completion.get_context', started)
+        # print context, visibility, operator
+        if len(context) == 1 and operator != '->' and operator != '::':
+            context = ['__global__', context[0]]
+
+        # Iterate context and find completion at this point
+        if not context:
+            return []
+        if cancelled():
+            return None
+        started = timing.start()
+        intel.load_indexes(self.folders)
+        timing.stop('completion.load_index', started)
+
+        if cancelled():
+            return None
+        started = timing.start()
+        context_class, context_partial = intel.get_class(context)
+        timing.stop('completion.get_class', started)
+        # print '>>>', context, visibility, context_class, context_partial, str(time.time())
+
+        if context_class:
+            if cancelled():
+                return None
+            started = timing.start()
+            intel.find_completions(context, operator, context_class, context_partial, found, visibility)
+            timing.stop('completion.find_completions', started)
+        timing.stop('completion', completion_started)
+
+        return format_completions(found)
+
+    def matches(self, request):
+        '''
+        Returns True if the completions for this request are also those for
+        request: at the same point in the same text, or further along the
+        same word with nothing before it changed, and the index hasn't
+        changed since
+        '''
+        if request.view_id != self.view_id or request.word_start != self.word_start or request.generation != self.generation:
+            return False
+        if request.change_count == self.change_count and request.point == self.point:
+            return True
+        return request.prefix.startswith(self.prefix) and request.source[:self.word_start] == self.source[:self.word_start]
+
+
+def format_completions(found):
+    data = []
+    for i in found:
+        snippet = None
+        argnames = []
+        if i.kind == 'var':
+            snippet = i.name.replace('$', '')
+            returns = i.returns if i.returns else 'mixed'
+            data.append(tuple([str(i.name) + '\t' + returns, str(snippet)]))
+        if i.kind == 'class':
+            snippet = i.name
+            returns = i.returns if i.returns else 'mixed'
+            data.append(tuple([str(i.name) + '\t' + returns, str(snippet)]))
+        if i.kind == 'func':
+            a = []
+            if len(i.args):
+                args = i.args
+                argnames = []
+                for j in range(0, len(args)):
+                    argname, argtype = args[j]
+                    argnames.append(argname)
+                    a.append('${' + str(j + 1) + ':' + argname.replace('$', '\\$') + '}')
+            snippet = '{name}({args})'.format(name=i.name, args=', '.join(a))
+            returns = i.returns if i.returns else 'mixed'
+            data.append(tuple([str(i.name) + '(' + ', '.join(argnames) + ')' + '\t' + returns, str(snippet)]))
+
+    # Remove duplicates and sort
+    return sorted(list(set(data)))
+    #return (data, sublime.INHIBIT_EXPLICIT_COMPLETIONS | sublime.INHIBIT_WORD_COMPLETIONS)
+
+
+class CompletionCache(object):
+    '''
+    The last completions computed for each view
+    '''
+    def __init__(self):
+        self.views = {}
+
+    def get(self, request):
+        return self.views.get(request.view_id)
+
+    def put(self, request):
+        self.views[request.view_id] = request
+
+    def forget(self, view):
+        self.views.pop(view.id(), None)
+
+
+_completion_cache = CompletionCache()
+
+
+class CompletionThread(threading.Thread):
+    '''
+    Computes completions off the UI thread, one request at a time. A new
+    request cancels the one before it: a request still waiting is dropped,
+    and one being computed stops at its next step. When the completions
+    are ready the auto complete popup is opened again to show them.
+    '''
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.pending = None
+        self.current = None
+        threading.Thread.__init__(self)
+        self.daemon = True
+
+    def submit(self, request):
+        with self.condition:
+            self.pending = request
+            self.current = request
+            if not self.is_alive():
+                self.start()
+            self.condition.notify()
+
+    def cancel(self):
+        with self.condition:
+            self.pending = None
+            self.current = None
+
+    def cancelled(self, request):
+        return request is not self.current or _scan_thread != None
+
+    def run(self):
+        while True:
+            with self.condition:
+                while self.pending == None:
+                    self.condition.wait()
+                request = self.pending
+                self.pending = None
+
+            try:
+                data = request.compute(lambda: self.cancelled(request))
+            except Exception as e:
+                # The index can change under a completion while a scan
+                # starts; the result would be thrown away anyway
+                if not self.cancelled(request):
+                    print 'SublimePHPIntel: Error finding completions: ' + str(e)
+                continue
+            if data == None or self.cancelled(request):
+                continue
+            request.data = data
+            sublime.set_timeout(lambda: self.deliver(request), 0)
+
+    def deliver(self, request):
+        '''
+        Cache the completions and show them, on the UI thread
+        '''
+        if self.cancelled(request):
+            return
+        view = request.view
+        _completion_cache.put(request)
+        if view.change_count() != request.change_count or view.sel()[0].a != request.point:
+            return
+        if (request.returned or []) == request.data:
+            # Already showing these
+            return
+        view.run_command('hide_auto_complete')
+        view.run_command('auto_complete', {
+            'disable_auto_insert': True,
+            'api_completions_only': False,
+            'next_completion_if_showing': False,
+        })
+
+
+_completion_thread = CompletionThread()
+
+
 class EventListener(sublime_plugin.EventListener):
     def on_post_save(self, view):
-        start_scan(path=view.file_name())
+        window = view.window() or sublime.active_window()
+        start_scan(path=view.file_name(), folders=window.folders())
+
+    def on_activated(self, view):
+        update_watcher()
 
     def on_query_completions(self, view, prefix, locations):
         if _scan_thread:
             return
-            
-        intel.reset()
-        
-        data = []
-        found = []
 
         point = view.sel()[0].a
-        
+
         if view.score_selector(point, 'source.php') == 0 or view.score_selector(point, 'string.quoted') > 0:
             return False
 
-        if self.has_intel():
-            # Find context
-            source = view.substr(sublime.Region(0, view.size()))
-            context, visibility, operator = phpparser.get_context(source, point)
-            # print context, visibility, operator
-            if len(context) == 1 and operator != '->' and operator != '::':
-                context = ['__global__', context[0]]
-
-            # Iterate context and find completion at this point
-            if context:
-                for f in sublime.active_window().folders():
-                    intel.load_index(f)
-            else:
-                return False
-
-            if not intel:
-                return False
-
-            context_class, context_partial = intel.get_class(context)
-            # print '>>>', context, visibility, context_class, context_partial, str(time.time())
-
-            if context_class:
-                intel.find_completions(context, operator, context_class, context_partial, found, visibility, [])
+        if not self.has_intel():
+            return False
 
-        if found:
-            for i in found:
-                snippet = None
-                argnames = []
-                if i['kind'] == 'var':
-                    snippet = i['name'].replace('$', '')
-                    returns = i['returns'] if i['returns'] else 'mixed'
-                    data.append(tuple([str(i['name']) + '\t' + returns, str(snippet)]))
-                if i['kind'] == 'class':
-                    snippet = i['name']
-                    returns = i['returns'] if i['returns'] else 'mixed'
-                    data.append(tuple([str(i['name']) + '\t' + returns, str(snippet)]))
-                if i['kind'] == 'func':
-                    a = []
-                    if len(i['args']):
-                        args = i['args']
-                        argnames = []
-                        for j in range(0, len(args)):
-                            argname, argtype = args[j]
-                            argnames.append(argname)
-                            a.append('${' + str(j + 1) + ':' + argname.replace('$', '\\$') + '}')
-                    snippet = '{name}({args})'.format(name=i['name'], args=', '.join(a))
-                    returns = i['returns'] if i['returns'] else 'mixed'
-                    data.append(tuple([str(i['name']) + '(' + ', '.join(argnames) + ')' + '\t' + returns, str(snippet)]))
-
-        if data:
-            # Remove duplicates and sort
-            data = sorted(list(set(data)))
-            return data
-            #return (data, sublime.INHIBIT_EXPLICIT_COMPLETIONS | sublime.INHIBIT_WORD_COMPLETIONS)
+        source = view.substr(sublime.Region(0, view.size()))
+        request = CompletionRequest(view, source, point, prefix, sublime.active_window().folders())
+
+        s = sublime.load_settings("SublimePHPIntel.sublime-settings")
+        if not s.get('completion_async', True):
+            return request.compute() or False
+
+        # Completions computed in the background for exactly this point, or
+        # for an earlier point in the same word, which are still valid
+        # because the popup filters them by what has been typed since.
+        # Anywhere else the popup is opened again once they are found.
+        cached = _completion_cache.get(request)
+        if cached != None and cached.matches(request):
+            request.returned = cached.data
+            _completion_thread.cancel()
         else:
-            return False
+            _completion_thread.submit(request)
+        return request.returned or False
+
+    def on_close(self, view):
+        _class_spans.forget(view)
+        _completion_cache.forget(view)
 
     def has_intel(self):
         for f in sublime.active_window().folders():
@@ -186,24 +436,116 @@ class EventListener(sublime_plugin.EventListener):
 
 _scan_thread = None
 _scan_lock = threading.RLock()
+_scan_queue = scheduler.ScanQueue()
+_watcher = None
 
 
-def start_scan(path='__all__'):
+def start_scan(path='__all__', priority=None, folders=None):
+    '''
+    Queue the whole project, a file or a sequence of files for scanning.
+    Files are scanned at scheduler.INTERACTIVE priority unless another is
+    given. folders are the project folders to scan, or that the files
+    belong to, and default to those of the active window.
+    '''
     global _scan_thread
 
+    if folders == None:
+        folders = sublime.active_window().folders()
+
     with _scan_lock:
         if _scan_thread:
-            _scan_thread.queue(path)
-        else:
+            _scan_thread.add_folders(folders)
+        _scan_queue.add(path, priority, folders)
+        if not _scan_thread:
             s = sublime.load_settings("SublimePHPIntel.sublime-settings")
-            blacklist = s.get("scan_blacklist")
-            folders = sublime.active_window().folders();
-
-            _scan_thread = ScanThread(blacklist, folders)
-            _scan_thread.queue(path)
+            patterns = s.get("scan_blacklist")
+            gitignore = s.get("scan_gitignore", False)
+            batch_size = s.get("scan_batch_size", 100)
+            workers = s.get("scan_workers", 0)
+            if workers < 1:
+                workers = get_cpu_count()
+            cpu_budget = s.get("scan_cpu_budget", 0.5)
+
+            _scan_thread = ScanThread(patterns, folders, batch_size, workers, cpu_budget, _scan_queue, gitignore)
             _scan_thread.start()
 
 
+def update_watcher(restart=False):
+    '''
+    Watch the scanned folders of every open window, so that PHP files added,
+    changed or removed outside of the editor are scanned again. The watcher
+    is only replaced when the folders change, or if restart is True.
+    '''
+    global _watcher
+
+    s = sublime.load_settings("SublimePHPIntel.sublime-settings")
+    folders = []
+    if s.get('watch_files', True):
+        for window in sublime.windows():
+            for f in window.folders():
+                if f not in folders and os.path.isdir(os.path.join(f, '.phpintel')):
+                    folders.append(f)
+    folders.sort()
+
+    if _watcher and _watcher.folders == folders and not restart:
+        return
+    if _watcher:
+        _watcher.stop()
+        _watcher = None
+    if folders:
+        excludes, excludes_folder = blacklist.for_folders(s.get('scan_blacklist'), folders, s.get('scan_gitignore', False))
+        _watcher = watcher.Watcher(folders, lambda paths: files_changed(paths, folders), exclude=excludes, exclude_folder=excludes_folder, delay=s.get('watch_delay', 1.0))
+        _watcher.start()
+
+
+def files_changed(paths, folders):
+    '''
+    Called by the watcher thread with a batch of changed files and folders
+    in the watched folders
+    '''
+    sublime.set_timeout(lambda: queue_changes(paths, folders), 0)
+
+
+def queue_changes(paths, folders):
+    '''
+    Queue changes reported by the watcher for the project folders they are
+    in, which may belong to any window
+    '''
+    files = tuple([p for p in paths if os.path.splitext(p)[1] == '.php'])
+    rescan = set()
+    for path in paths:
+        if os.path.splitext(path)[1] != '.php':
+            # A folder was moved or removed, or changes were missed, so look
+            # for changes in the whole project folder
+            rescan.add(find_folder(path, folders, True))
+    rescan.discard(None)
+    if rescan:
+        start_scan(folders=sorted(rescan))
+    if files:
+        start_scan(files, scheduler.BACKGROUND, sorted(set([find_folder(p, folders) for p in files]) - set([None])))
+
+
+def find_folder(path, folders, inclusive=False):
+    '''
+    Return the innermost of folders that path is in, or None. With
+    inclusive, a path that is one of the folders is in it.
+    '''
+    found = None
+    for folder in folders:
+        if path.startswith(folder + os.sep) or (inclusive and path == folder):
+            if found == None or len(folder) > len(found):
+                found = folder
+    return found
+
+
+def get_cpu_count():
+    try:
+        import multiprocessing
+        return multiprocessing.cpu_count()
+    except (ImportError, NotImplementedError):
+        return 1
+
+
 def abort_scan():
     global _scan_thread
 
@@ -212,19 +554,50 @@ def abort_scan():
 
 
 class ScanThread(threading.Thread):
-    _scan_queue = []
     _abort = False
     _blacklist = None
+    _gitignore = False
+    _blacklists = None
     _folders = None
-
-    def __init__(self, blacklist, folders):
+    _batch_size = 100
+    _workers = 1
+    _cpu_budget = 1.0
+    _queue = None
+    _throttle = None
+    _unthrottled = None
+    _full_scan = False
+    _index = None
+    _manifest = None
+    _known = None
+    _pending = None
+    _skipped = 0
+    _unsaved = 0
+
+    def __init__(self, blacklist, folders, batch_size=100, workers=1, cpu_budget=1.0, queue=None, gitignore=False):
         self._blacklist = blacklist
-        self._folders = folders
+        self._gitignore = gitignore
+        self._blacklists = {}
+        self._folders = list(folders)
+        self._batch_size = batch_size
+        self._workers = workers
+        self._cpu_budget = cpu_budget
+        if queue == None:
+            queue = scheduler.ScanQueue()
+        self._queue = queue
         threading.Thread.__init__(self)
 
-    def queue(self, path='__all__'):
-        if not path in self._scan_queue:
-            self._scan_queue.append(path)
+    def queue(self, path='__all__', priority=None):
+        self._queue.add(path, priority, self._folders)
+
+    def add_folders(self, folders):
+        '''
+        Take on the project folders of another window. Called with
+        _scan_lock held, so that the folders are known before work for them
+        is queued.
+        '''
+        for f in folders:
+            if f not in self._folders:
+                self._folders.append(f)
 
     def abort(self):
         self._abort = True
@@ -233,67 +606,59 @@ class ScanThread(threading.Thread):
         self._abort = False
         self.progress = ThreadProgress(self, '', '')
         self.progress.start()
+        self._throttle = scheduler.Throttle(self._cpu_budget, get_cpu_count())
+        # Files saved in the editor are scanned flat out
+        self._unthrottled = scheduler.Throttle()
         start_time = time.time()
         scanned_something = False
 
-        def in_blacklist(path):
-            for b in self._blacklist:
-                if path.find(b) >= 0:
-                    return True
-            return False
-
         while True:
             with _scan_lock:
-                if len(self._scan_queue) == 0:
+                work = self._queue.pop()
+                if work == None:
                     global _scan_thread
                     _scan_thread = None
+                    phpparser.close_worker()
                     return
 
-                filename = self._scan_queue.pop()
-
-            if filename == '__all__':
-                # Scan entire project
-                for f in self._folders:
-                    intel.reset()
+            kind, paths, priority = work
+            if kind == '__all__':
+                # Scan entire project, skipping files that haven't changed
+                # since the last scan
+                self._full_scan = True
+                for f in paths:
                     if self._abort:
                         break
-                    for root, dirs, files in os.walk(f, followlinks=True):
-                        if self._abort:
-                            break
-                        for name in files:
-                            if self._abort:
-                                break
-                            if os.path.splitext(name)[1] == '.php':
-                                scanned_something = True
-                                path = os.path.join(root, name)
-                                if in_blacklist(path):
-                                    continue
-                                newpath, currentfile = os.path.split(path)
-                                newpath, lastdir = os.path.split(newpath)
-                                self.progress.message = 'Scanning .../' + lastdir + '/' + currentfile
-                                d = phpparser.scan_file(path)
-                                if d:
-                                    intel.save(d, f, path)
-                                    intel.update_index(path, *set([x['class'] for x in d]))
-                                time.sleep(0.010)
-                    intel.save_index(f)
-            elif filename:
-                # Scan one file
-                if os.path.splitext(filename)[1] == '.php':
-                    path = filename
-                    if in_blacklist(path):
-                        return
-                    for f in self._folders:
-                        if path.startswith(f):
-                            self.progress.message = 'Scanning ' + path
-                            scanned_something = True
-                            d = phpparser.scan_file(path)
-                            intel.save(d, f, path)
-                            intel.reset()
-                            intel.load_index(f)
-                            intel.update_index(path, *set([x['class'] for x in d]))
-                            intel.save_index(f)
-                            break
+                    self._index = intel.FolderIndex(f)
+                    self._manifest = intel.load_manifest(f)
+                    self._known = self._manifest
+                    self._pending = {}
+                    seen = set()
+                    # Read the blacklist again, in case .gitignore changed
+                    self._blacklists.pop(f, None)
+                    b = self.get_blacklist(f)
+                    files = self.changed_files(phpparser.find_files(f, exclude=b.excludes_file, exclude_folder=b.excludes_folder), seen)
+                    if self._workers > 1:
+                        self.scan_parallel(f, files, self._throttle)
+                    else:
+                        self.scan_sequential(f, files, self._throttle)
+                    scanned_something = scanned_something or len(seen) > 0
+                    if not self._abort:
+                        # Drop files that were deleted or blacklisted,
+                        # including those indexed without a manifest entry
+                        for path in set(self._manifest.keys()) | set(self._index.paths()):
+                            if path not in seen:
+                                intel.remove(f, path)
+                                self._index.update(path)
+                                self._manifest.pop(path, None)
+                    self._index.save()
+                    intel.save_manifest(f, self._manifest)
+            else:
+                # Files saved in the editor, or a batch of files reported by
+                # the watcher
+                self._full_scan = False
+                throttle = self._unthrottled if priority == scheduler.INTERACTIVE else self._throttle
+                scanned_something = self.scan_paths(paths, throttle) or scanned_something
 
             if scanned_something:
                 elapsed_s = time.time() - start_time
@@ -302,6 +667,250 @@ class ScanThread(threading.Thread):
                 else:
                     elapsed = '{sec:.2f}s'.format(sec=elapsed_s)
                 self.progress.success_message = 'Scan completed in {elapsed}'.format(elapsed=elapsed)
+                if self._skipped:
+                    self.progress.success_message += ' ({skipped:d} unchanged files skipped)'.format(skipped=self._skipped)
+
+
+    def get_blacklist(self, folder):
+        b = self._blacklists.get(folder)
+        if b == None:
+            b = self._blacklists[folder] = blacklist.Blacklist(self._blacklist, folder, self._gitignore)
+        return b
+
+    def in_folder(self, folder, path):
+        '''
+        Returns True if path is a PHP file that belongs to folder, rather
+        than to a project folder inside it, and isn't blacklisted
+        '''
+        return find_folder(path, self._folders) == folder and os.path.splitext(path)[1] == '.php' and not self.get_blacklist(folder).excludes(path)
+
+    def scan_paths(self, paths, throttle):
+        '''
+        Scan the given files, which may have been added, changed or deleted,
+        into the project folders they belong to. Returns True if any of them
+        belong to one.
+        '''
+        scanned_something = False
+        for f in list(self._folders):
+            if self._abort:
+                break
+            files = [p for p in paths if self.in_folder(f, p)]
+            if not files:
+                continue
+            scanned_something = True
+            if len(files) == 1:
+                self.progress.message = 'Scanning ' + files[0]
+
+            self._index = intel.FolderIndex(f)
+            # Only the changed entries are written back, and only the entries
+            # of the files being scanned are read
+            self._manifest = {}
+            self._known = {}
+            self._pending = {}
+            existing = self.remove_deleted(f, files)
+            if self._workers > 1 and len(existing) > self._batch_size:
+                self.scan_parallel(f, existing, throttle)
+            else:
+                self.scan_sequential(f, existing, throttle)
+            intel.commit(f)
+            self._index.save()
+            intel.update_manifest(f, self._manifest)
+
+        return scanned_something
+
+    def remove_deleted(self, folder, files):
+        '''
+        Forget files that no longer exist and return those that have changed
+        since they were last scanned, which are added to the pending
+        signatures. The watcher reports a file saved in the editor as well,
+        so it is only scanned once. Outside of a full scan the manifest
+        entries of files are read as they are needed.
+        '''
+        existing = []
+        if not self._full_scan:
+            self._known.update(intel.load_signatures(folder, [p for p in files if p not in self._known]))
+        for path in files:
+            try:
+                signature, changed = intel.get_signature(path, self._known)
+                if changed:
+                    self._pending[path] = signature
+                    existing.append(path)
+                else:
+                    self._skipped += 1
+            except (IOError, OSError):
+                intel.remove(folder, path)
+                self._index.update(path)
+                self._known.pop(path, None)
+                if self._full_scan:
+                    self._manifest.pop(path, None)
+                else:
+                    self._manifest[path] = None
+        return existing
+
+    def preempt(self, folder):
+        '''
+        Scan files in folder that were saved in the editor while this scan
+        was running, instead of leaving them until it is done. Called
+        between batches, when the tokenizer of this thread is idle. They are
+        not throttled.
+        '''
+        while not self._abort:
+            work = self._queue.pop(self._batch_size, folder + os.sep, scheduler.INTERACTIVE)
+            if work == None:
+                return
+            others = [p for p in work[1] if find_folder(p, self._folders) != folder]
+            if others:
+                # Files of a project folder inside this one
+                self._queue.add(others, scheduler.INTERACTIVE)
+                if len(others) == len(work[1]):
+                    return
+            existing = self.remove_deleted(folder, [p for p in work[1] if self.in_folder(folder, p)])
+            if existing:
+                self.scan_batch(folder, existing, self._unthrottled)
+
+    def changed_files(self, files, seen):
+        '''
+        Filter files down to those that are new or have changed since they
+        were recorded in the manifest. Every path is added to seen.
+        '''
+        for path in files:
+            seen.add(path)
+            try:
+                signature, changed = intel.get_signature(path, self._manifest)
+            except (IOError, OSError):
+                continue
+            if changed:
+                self._pending[path] = signature
+                yield path
+            else:
+                self._manifest[path] = signature
+                self._skipped += 1
+
+    def scan_sequential(self, folder, files, throttle):
+        '''
+        Scan files in batches on this thread.
+        '''
+        batch = []
+        for path in files:
+            if self._abort:
+                break
+            batch.append(path)
+            if len(batch) >= self._batch_size:
+                self.scan_batch(folder, batch, throttle)
+                batch = []
+                self.preempt(folder)
+                throttle.resume()
+        if batch and not self._abort:
+            self.scan_batch(folder, batch, throttle)
+
+    def scan_batch(self, folder, batch, throttle):
+        '''
+        Scan a batch of files in folder and add them to the index.
+        '''
+        scanner = phpparser.scan_files(batch)
+        try:
+            for path, d in scanner:
+                if self._abort:
+                    break
+                self.save_file(folder, path, d)
+                throttle.tick()
+        finally:
+            scanner.close()
+
+    def scan_parallel(self, folder, files, throttle):
+        '''
+        Scan files using a pool of worker threads. Each worker has its own
+        tokenizer process and converts the tokens it gets back; this thread
+        is the only writer to the intel store and index, and scans files
+        saved in the editor in between. The workers and this thread share
+        throttle.
+        '''
+        batches = Queue.Queue(self._workers * 2)
+        results = Queue.Queue(self._batch_size * self._workers)
+
+        def feed():
+            batch = []
+            for path in files:
+                if self._abort:
+                    break
+                batch.append(path)
+                if len(batch) >= self._batch_size:
+                    batches.put(batch)
+                    batch = []
+            if batch and not self._abort:
+                batches.put(batch)
+            for i in range(0, self._workers):
+                batches.put(None)
+
+        def work():
+            try:
+                while True:
+                    batch = batches.get()
+                    if batch == None:
+                        break
+                    if self._abort:
+                        continue
+                    throttle.resume()
+                    scanner = phpparser.scan_files(batch)
+                    try:
+                        for result in scanner:
+                            if self._abort:
+                                break
+                            throttle.tick()
+                            results.put(result)
+                            throttle.resume()
+                    finally:
+                        scanner.close()
+            finally:
+                phpparser.close_worker()
+                results.put(None)
+
+        threads = [threading.Thread(target=feed)]
+        for i in range(0, self._workers):
+            threads.append(threading.Thread(target=work))
+        for t in threads:
+            t.start()
+
+        running = self._workers
+        while running:
+            result = results.get()
+            if result == None:
+                running -= 1
+            elif not self._abort:
+                throttle.resume()
+                path, d = result
+                self.save_file(folder, path, d)
+                throttle.tick()
+                if not self._unsaved:
+                    self.preempt(folder)
+
+        for t in threads:
+            t.join()
+
+    def save_file(self, folder, path, d):
+        newpath, currentfile = os.path.split(path)
+        newpath, lastdir = os.path.split(newpath)
+        self.progress.message = 'Scanning .../' + lastdir + '/' + currentfile
+        queued = len(self._queue)
+        if queued:
+            self.progress.message += ' ({queued:d} queued)'.format(queued=queued)
+        started = timing.start()
+        if d:
+            intel.save(d, folder, path)
+        else:
+            intel.remove(folder, path)
+        timing.stop('scan.save', started)
+        started = timing.start()
+        self._index.update(path, *set([x.class_name for x in d]))
+        timing.stop('scan.index', started)
+        if path in self._pending:
+            self._manifest[path] = self._known[path] = self._pending.pop(path)
+        self._unsaved += 1
+        if self._unsaved >= self._batch_size:
+            started = timing.start()
+            intel.commit(folder)
+            timing.stop('scan.commit', started)
+            self._unsaved = 0
 
 
 class ThreadProgress(threading.Thread):
@@ -337,3 +946,17 @@ class ThreadProgress(threading.Thread):
 
     def update_status(self, message):
         sublime.set_timeout(lambda: sublime.status_message(message), 0)
+
+
+def apply_settings():
+    s = sublime.load_settings("SublimePHPIntel.sublime-settings")
+    phpparser.set_tokenizer(s.get('tokenizer', 'php'))
+    intel.set_store_backend(s.get('intel_store', 'sqlite'))
+    intel.set_cache_size(s.get('intel_cache_size', 50000))
+    timing.enable(s.get('timing', False))
+    phpparser.set_patterns((s.get('customfactories') or []) + (s.get('factories') or []))
+    update_watcher(True)
+
+
+sublime.load_settings("SublimePHPIntel.sublime-settings").add_on_change('phpintel', apply_settings)
+apply_settings()
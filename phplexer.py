@@ -0,0 +1,455 @@
+'''
+PHP lexer
+
+A pure Python replacement for PHP's token_get_all(). Tokens are returned in
+the same (kind, stmt, line) form produced by phpparser.token(), so the rest of
+the parser does not need to know which backend produced them.
+
+Token names follow PHP 7: namespaced names are split into T_STRING and
+T_NS_SEPARATOR tokens, and single character tokens have no kind and a line of
+zero.
+'''
+
+'''
+PHP Lexer
+Copyright 2012 John Watson <https://github.com/jotson>
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights to
+use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of
+the Software, and to permit persons to whom the Software is furnished to do so,
+subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+'''
+
+import re
+
+
+_keywords = {
+    'abstract': 'T_ABSTRACT',
+    'and': 'T_LOGICAL_AND',
+    'array': 'T_ARRAY',
+    'as': 'T_AS',
+    'break': 'T_BREAK',
+    'callable': 'T_CALLABLE',
+    'case': 'T_CASE',
+    'catch': 'T_CATCH',
+    'class': 'T_CLASS',
+    'clone': 'T_CLONE',
+    'const': 'T_CONST',
+    'continue': 'T_CONTINUE',
+    'declare': 'T_DECLARE',
+    'default': 'T_DEFAULT',
+    'die': 'T_EXIT',
+    'do': 'T_DO',
+    'echo': 'T_ECHO',
+    'else': 'T_ELSE',
+    'elseif': 'T_ELSEIF',
+    'empty': 'T_EMPTY',
+    'enddeclare': 'T_ENDDECLARE',
+    'endfor': 'T_ENDFOR',
+    'endforeach': 'T_ENDFOREACH',
+    'endif': 'T_ENDIF',
+    'endswitch': 'T_ENDSWITCH',
+    'endwhile': 'T_ENDWHILE',
+    'eval': 'T_EVAL',
+    'exit': 'T_EXIT',
+    'extends': 'T_EXTENDS',
+    'final': 'T_FINAL',
+    'finally': 'T_FINALLY',
+    'fn': 'T_FN',
+    'for': 'T_FOR',
+    'foreach': 'T_FOREACH',
+    'function': 'T_FUNCTION',
+    'global': 'T_GLOBAL',
+    'goto': 'T_GOTO',
+    'if': 'T_IF',
+    'implements': 'T_IMPLEMENTS',
+    'include': 'T_INCLUDE',
+    'include_once': 'T_INCLUDE_ONCE',
+    'instanceof': 'T_INSTANCEOF',
+    'insteadof': 'T_INSTEADOF',
+    'interface': 'T_INTERFACE',
+    'isset': 'T_ISSET',
+    'list': 'T_LIST',
+    'namespace': 'T_NAMESPACE',
+    'new': 'T_NEW',
+    'or': 'T_LOGICAL_OR',
+    'print': 'T_PRINT',
+    'private': 'T_PRIVATE',
+    'protected': 'T_PROTECTED',
+    'public': 'T_PUBLIC',
+    'require': 'T_REQUIRE',
+    'require_once': 'T_REQUIRE_ONCE',
+    'return': 'T_RETURN',
+    'static': 'T_STATIC',
+    'switch': 'T_SWITCH',
+    'throw': 'T_THROW',
+    'trait': 'T_TRAIT',
+    'try': 'T_TRY',
+    'unset': 'T_UNSET',
+    'use': 'T_USE',
+    'var': 'T_VAR',
+    'while': 'T_WHILE',
+    'xor': 'T_LOGICAL_XOR',
+    'yield': 'T_YIELD',
+    '__class__': 'T_CLASS_C',
+    '__dir__': 'T_DIR',
+    '__file__': 'T_FILE',
+    '__function__': 'T_FUNC_C',
+    '__halt_compiler': 'T_HALT_COMPILER',
+    '__line__': 'T_LINE',
+    '__method__': 'T_METHOD_C',
+    '__namespace__': 'T_NS_C',
+    '__trait__': 'T_TRAIT_C',
+}
+
+_casts = {
+    'int': 'T_INT_CAST',
+    'integer': 'T_INT_CAST',
+    'bool': 'T_BOOL_CAST',
+    'boolean': 'T_BOOL_CAST',
+    'float': 'T_DOUBLE_CAST',
+    'double': 'T_DOUBLE_CAST',
+    'real': 'T_DOUBLE_CAST',
+    'string': 'T_STRING_CAST',
+    'binary': 'T_STRING_CAST',
+    'array': 'T_ARRAY_CAST',
+    'object': 'T_OBJECT_CAST',
+    'unset': 'T_UNSET_CAST',
+}
+
+# Longest operators first so that the alternation picks the longest match
+_operators = [
+    ('<<=', 'T_SL_EQUAL'),
+    ('>>=', 'T_SR_EQUAL'),
+    ('**=', 'T_POW_EQUAL'),
+    ('??=', 'T_COALESCE_EQUAL'),
+    ('...', 'T_ELLIPSIS'),
+    ('<=>', 'T_SPACESHIP'),
+    ('===', 'T_IS_IDENTICAL'),
+    ('!==', 'T_IS_NOT_IDENTICAL'),
+    ('++', 'T_INC'),
+    ('--', 'T_DEC'),
+    ('->', 'T_OBJECT_OPERATOR'),
+    ('=>', 'T_DOUBLE_ARROW'),
+    ('::', 'T_DOUBLE_COLON'),
+    ('==', 'T_IS_EQUAL'),
+    ('!=', 'T_IS_NOT_EQUAL'),
+    ('<>', 'T_IS_NOT_EQUAL'),
+    ('<=', 'T_IS_SMALLER_OR_EQUAL'),
+    ('>=', 'T_IS_GREATER_OR_EQUAL'),
+    ('+=', 'T_PLUS_EQUAL'),
+    ('-=', 'T_MINUS_EQUAL'),
+    ('*=', 'T_MUL_EQUAL'),
+    ('/=', 'T_DIV_EQUAL'),
+    ('.=', 'T_CONCAT_EQUAL'),
+    ('%=', 'T_MOD_EQUAL'),
+    ('&=', 'T_AND_EQUAL'),
+    ('|=', 'T_OR_EQUAL'),
+    ('^=', 'T_XOR_EQUAL'),
+    ('<<', 'T_SL'),
+    ('>>', 'T_SR'),
+    ('&&', 'T_BOOLEAN_AND'),
+    ('||', 'T_BOOLEAN_OR'),
+    ('**', 'T_POW'),
+    ('??', 'T_COALESCE'),
+    ('\\', 'T_NS_SEPARATOR'),
+]
+_operator_names = dict(_operators)
+
+_label = u'[a-zA-Z_\x80-\uffff][a-zA-Z0-9_\x80-\uffff]*'
+
+_open_tag_re = re.compile(r'<\?php(?:[ \t]|\r\n|\n|\r|$)|<\?=|<\?', re.I)
+_whitespace_re = re.compile(r'[ \t\r\n]+')
+_close_tag_re = re.compile(r'\?>(?:\r\n|\n)?')
+_doc_comment_re = re.compile(r'/\*\*\s.*?(?:\*/|\Z)', re.S)
+_comment_re = re.compile(r'/\*.*?(?:\*/|\Z)|(?://|#).*?(?:\r\n|\n|(?=\?>)|\Z)', re.S)
+_variable_re = re.compile(u'\\$' + _label, re.U)
+_label_re = re.compile(_label, re.U)
+_number_re = re.compile(r'''
+    (?P<hex>0[xX][0-9a-fA-F]+(?:_[0-9a-fA-F]+)*)
+    |(?P<bin>0[bB][01]+(?:_[01]+)*)
+    |(?P<float>(?:[0-9]+(?:_[0-9]+)*)?\.[0-9]+(?:_[0-9]+)*(?:[eE][+-]?[0-9]+)?
+        |[0-9]+(?:_[0-9]+)*\.(?:[0-9]+(?:_[0-9]+)*)?(?:[eE][+-]?[0-9]+)?
+        |[0-9]+(?:_[0-9]+)*[eE][+-]?[0-9]+)
+    |(?P<int>[0-9]+(?:_[0-9]+)*)
+''', re.X)
+_cast_re = re.compile(r'\([ \t]*(' + '|'.join(_casts.keys()) + r')[ \t]*\)', re.I)
+_single_quoted_re = re.compile(r"[bB]?'(?:[^'\\]|\\.)*'", re.S)
+_double_quoted_re = re.compile(r'[bB]?"(?:[^"\\]|\\.)*"', re.S)
+_quote_re = re.compile(r'[bB]?[\'"]')
+_heredoc_re = re.compile(u'[bB]?<<<[ \t]*(?:"(' + _label + u')"|\'(' + _label + u')\'|(' + _label + u'))(?:\r\n|\n|\r)', re.U)
+_operator_re = re.compile('|'.join([re.escape(o) for o, name in _operators]))
+_interpolation_re = re.compile(u'\\$' + _label + u'|\\{\\$|\\$\\{', re.U)
+_num_string_re = re.compile(r'0|[1-9][0-9]*|0[xX][0-9a-fA-F]+|0[0-7]+|0[bB][01]+')
+
+
+class Lexer(object):
+    '''
+    Tokenizes one PHP source string.
+    '''
+    def __init__(self, source):
+        self.source = source
+        self.pos = 0
+        self.line = 1
+        self.tokens = []
+        self.after_object_operator = False
+
+    def emit(self, kind, stmt):
+        if kind:
+            self.tokens.append((kind, stmt, self.line))
+        else:
+            self.tokens.append((None, stmt, 0))
+        self.line += stmt.count('\n')
+        self.pos += len(stmt)
+
+    def lex(self):
+        source = self.source
+        while self.pos < len(source):
+            # Inline HTML up to the next open tag
+            m = _open_tag_re.search(source, self.pos)
+            if not m:
+                self.emit('T_INLINE_HTML', source[self.pos:])
+                break
+            if m.start() > self.pos:
+                self.emit('T_INLINE_HTML', source[self.pos:m.start()])
+            if m.group(0) == '<?=':
+                self.emit('T_OPEN_TAG_WITH_ECHO', m.group(0))
+            else:
+                self.emit('T_OPEN_TAG', m.group(0))
+            self.lex_script()
+
+        return self.tokens
+
+    def lex_script(self, in_braces=False):
+        '''
+        Tokenize PHP code until a close tag, the end of the source or, when
+        in_braces is set, the brace that closes an interpolated expression.
+        '''
+        source = self.source
+        nest = 0
+        while self.pos < len(source):
+            pos = self.pos
+            c = source[pos]
+            after_object_operator = self.after_object_operator
+            self.after_object_operator = False
+
+            if c in ' \t\r\n':
+                self.emit('T_WHITESPACE', _whitespace_re.match(source, pos).group(0))
+                self.after_object_operator = after_object_operator
+                continue
+
+            if in_braces:
+                if c == '{':
+                    nest += 1
+                elif c == '}':
+                    if nest == 0:
+                        self.emit(None, c)
+                        return
+                    nest -= 1
+
+            m = _close_tag_re.match(source, pos)
+            if m:
+                self.emit('T_CLOSE_TAG', m.group(0))
+                return
+
+            if c == '/' or c == '#':
+                m = _doc_comment_re.match(source, pos)
+                if m:
+                    self.emit('T_DOC_COMMENT', m.group(0))
+                    continue
+                m = _comment_re.match(source, pos)
+                if m:
+                    self.emit('T_COMMENT', m.group(0))
+                    continue
+
+            if c == '$':
+                m = _variable_re.match(source, pos)
+                if m:
+                    self.emit('T_VARIABLE', m.group(0))
+                    continue
+
+            if c in 'bB' and pos + 1 < len(source) and source[pos + 1] in '\'"<':
+                if self.lex_string(pos):
+                    continue
+
+            if c.isdigit() or (c == '.' and pos + 1 < len(source) and source[pos + 1].isdigit()):
+                m = _number_re.match(source, pos)
+                if m.group('float'):
+                    self.emit('T_DNUMBER', m.group(0))
+                else:
+                    self.emit('T_LNUMBER', m.group(0))
+                continue
+
+            m = _label_re.match(source, pos)
+            if m:
+                word = m.group(0)
+                kind = 'T_STRING'
+                if not after_object_operator:
+                    kind = _keywords.get(word.lower(), 'T_STRING')
+                self.emit(kind, word)
+                continue
+
+            if c in '\'"<`':
+                if self.lex_string(pos):
+                    continue
+
+            if c == '(':
+                m = _cast_re.match(source, pos)
+                if m:
+                    self.emit(_casts[m.group(1).lower()], m.group(0))
+                    continue
+
+            m = _operator_re.match(source, pos)
+            if m:
+                kind = _operator_names[m.group(0)]
+                self.emit(kind, m.group(0))
+                if kind == 'T_OBJECT_OPERATOR':
+                    self.after_object_operator = True
+                continue
+
+            self.emit(None, c)
+
+    def lex_string(self, pos):
+        '''
+        Tokenize a quoted string, heredoc or nowdoc starting at pos. Returns
+        False if there is no string at pos.
+        '''
+        source = self.source
+        m = _single_quoted_re.match(source, pos)
+        if m:
+            self.emit('T_CONSTANT_ENCAPSED_STRING', m.group(0))
+            return True
+
+        m = _double_quoted_re.match(source, pos)
+        if m:
+            if not _interpolation_re.search(m.group(0)):
+                self.emit('T_CONSTANT_ENCAPSED_STRING', m.group(0))
+                return True
+            self.emit(None, m.group(0)[:m.group(0).index('"') + 1])
+            self.lex_encapsed(m.end() - 1)
+            self.emit(None, '"')
+            return True
+
+        m = _quote_re.match(source, pos)
+        if m:
+            # Unterminated string, e.g. when the source is cut at the cursor.
+            # Like PHP, the rest of a single quoted string is one token.
+            if m.group(0).endswith("'"):
+                self.emit('T_ENCAPSED_AND_WHITESPACE', source[pos:])
+            else:
+                self.emit(None, m.group(0))
+                self.lex_encapsed(len(source))
+            return True
+
+        m = _heredoc_re.match(source, pos)
+        if m:
+            label = m.group(1) or m.group(2) or m.group(3)
+            self.emit('T_START_HEREDOC', m.group(0))
+            end = re.compile(u'^[ \t]*' + re.escape(label) + u'\\b', re.M | re.U).search(source, self.pos)
+            body_end = end.start() if end else len(source)
+            if m.group(2):
+                if body_end > self.pos:
+                    self.emit('T_ENCAPSED_AND_WHITESPACE', source[self.pos:body_end])
+            else:
+                self.lex_encapsed(body_end)
+            if end:
+                self.emit('T_END_HEREDOC', end.group(0))
+            return True
+
+        if source[pos] == '`':
+            close = pos + 1
+            while close < len(source) and source[close] != '`':
+                close += 2 if source[close] == '\\' else 1
+            self.emit(None, '`')
+            self.lex_encapsed(min(close, len(source)))
+            if self.pos < len(source):
+                self.emit(None, '`')
+            return True
+
+        return False
+
+    def lex_encapsed(self, end):
+        '''
+        Tokenize the body of an interpolated string up to end.
+        '''
+        source = self.source
+        while self.pos < end:
+            m = _interpolation_re.search(source, self.pos, end)
+            while m and self.escaped(m.start()):
+                m = _interpolation_re.search(source, m.start() + 1, end)
+            if not m:
+                self.emit('T_ENCAPSED_AND_WHITESPACE', source[self.pos:end])
+                break
+            if m.start() > self.pos:
+                self.emit('T_ENCAPSED_AND_WHITESPACE', source[self.pos:m.start()])
+
+            text = m.group(0)
+            if text == '{$':
+                self.emit('T_CURLY_OPEN', '{')
+                self.lex_script(in_braces=True)
+            elif text == '${':
+                self.emit('T_DOLLAR_OPEN_CURLY_BRACES', text)
+                name = _label_re.match(source, self.pos)
+                if name and source[name.end():name.end() + 1] in ('[', '}'):
+                    self.emit('T_STRING_VARNAME', name.group(0))
+                self.lex_script(in_braces=True)
+            else:
+                self.emit('T_VARIABLE', text)
+                self.lex_simple_offset(end)
+
+    def lex_simple_offset(self, end):
+        '''
+        Tokenize the array offset or property that may follow a simple
+        interpolated variable.
+        '''
+        source = self.source
+        if source.startswith('->', self.pos) and self.pos + 2 < end:
+            name = _label_re.match(source, self.pos + 2)
+            if name:
+                self.emit('T_OBJECT_OPERATOR', '->')
+                self.emit('T_STRING', name.group(0))
+        elif source.startswith('[', self.pos):
+            close = source.find(']', self.pos, end)
+            if close < 0:
+                return
+            self.emit(None, '[')
+            if source[self.pos] == '-':
+                self.emit(None, '-')
+            offset = source[self.pos:close]
+            if _variable_re.match(offset):
+                self.emit('T_VARIABLE', offset)
+            elif _num_string_re.match(offset) and _num_string_re.match(offset).group(0) == offset:
+                self.emit('T_NUM_STRING', offset)
+            elif offset:
+                self.emit('T_STRING', offset)
+            self.emit(None, ']')
+
+    def escaped(self, pos):
+        '''
+        Return True if the character at pos is escaped with a backslash.
+        '''
+        count = 0
+        while pos > 0 and self.source[pos - 1] == '\\':
+            count += 1
+            pos -= 1
+        return count % 2 == 1
+
+
+def get_all_tokens(source):
+    '''
+    Returns all of the tokens for a given snippet of code.
+    '''
+    return Lexer(source).lex()
@@ -31,15 +31,25 @@ SOFTWARE.
 import os
 import sys
 import re
+import bisect
 import json
 import subprocess
-import tempfile
-import sublime
-import re
+import threading
+import time
 import string
+import phplexer
+import timing
+
 
+_constants = None
+_constants_lock = threading.Lock()
+_token_cache = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'token_names.json')
+_tokenizer = 'php'
+_patterns = []
+_pattern_timings = {}
 
-_constants = {}
+# Factory patterns slower than this many seconds are reported
+SLOW_PATTERN = 0.05
 startupinfo = None
 if os.name == 'nt':
     startupinfo = subprocess.STARTUPINFO()
@@ -56,29 +66,60 @@ def get_all_token_names():
     This code generates a dictionary of token constants from the installed
     version of PHP. The dictionary is later used to convert the token codes
     returned by PHP's token_get_all() into names.
+
+    Running PHP is slow, so the dictionary is cached on disk and only
+    regenerated when the php binary changes.
     '''
-    global _constants
-    _constants[0] = None
-    php = ''
-    for i in range(0, 999):
-        php += "echo '{code},'.token_name({code}).'|';".format(code=i)
-    result = subprocess.Popen(['php', '-r', php], bufsize=1, stdout=subprocess.PIPE, shell=False, startupinfo=startupinfo).communicate()[0]
+    key = get_php_key()
+    try:
+        with open(_token_cache, 'rb') as f:
+            cached = json.load(f)
+        if cached.get('key') == key:
+            return dict((int(code), str(name)) for code, name in cached['names'])
+    except (IOError, ValueError, KeyError, TypeError):
+        pass
+
+    php = "for ($i = 0; $i < 1000; $i++) { $n = token_name($i); if ($n != 'UNKNOWN') { echo $i, ',', $n, '|'; } }"
+    result = subprocess.Popen(['php', '-r', php], stdout=subprocess.PIPE, shell=False, startupinfo=startupinfo).communicate()[0]
+    names = {}
     for constant in result.split('|'):
         if constant.find(',') >= 0:
             code, name = constant.split(',')
-            if name != 'UNKNOWN':
-                _constants[str(code)] = name
+            names[int(code)] = name
+
+    if names:
+        try:
+            with open(_token_cache, 'wb') as f:
+                json.dump({'key': key, 'names': sorted(names.items())}, f)
+        except IOError:
+            pass
+    return names
+
+
+def get_php_key():
+    '''
+    Identify the installed php binary by its path, size and modification
+    time. This is cheap to compute and changes whenever PHP is upgraded.
+    '''
+    for folder in os.environ.get('PATH', '').split(os.pathsep):
+        for name in ('php', 'php.exe'):
+            path = os.path.join(folder, name)
+            if os.path.isfile(path):
+                st = os.stat(path)
+                return [os.path.realpath(path), st.st_size, int(st.st_mtime)]
+    return None
 
 
 def get_token_name(code):
     '''
     Get name for a given token code.
     '''
-    name = None
-    code = str(code)
-    if code in _constants:
-        name = _constants[code]
-    return name
+    global _constants
+    if _constants is None:
+        with _constants_lock:
+            if _constants is None:
+                _constants = get_all_token_names()
+    return _constants.get(code)
 
 
 def token(token):
@@ -90,62 +131,553 @@ def token(token):
         stmt = token[1]
         line = token[2]
     else:
-        kind = get_token_name(0)
+        kind = None
         stmt = token
         line = 0
 
     return kind, stmt, line
 
 
+# Tokenizer worker loop. Each request is a header line holding a request type
+# and a byte count, followed by that many bytes of payload. An 'S' request
+# carries PHP source; an 'F' request carries newline separated file paths. The
+# worker answers with one response per source or file, each framed as a byte
+# count on its own line followed by the json_encode()d token_get_all() result.
+_worker_script = '''
+function reply($source) {
+    $out = json_encode(@token_get_all($source));
+    if ($out === false) {
+        $out = '[]';
+    }
+    echo strlen($out), "\\n", $out;
+    flush();
+}
+while (($header = fgets(STDIN)) !== false) {
+    $len = intval(substr($header, 2));
+    $data = $len > 0 ? stream_get_contents(STDIN, $len) : '';
+    if ($header[0] == 'F') {
+        foreach (explode("\\n", $data) as $path) {
+            reply((string) @file_get_contents($path));
+        }
+    } else {
+        reply($data);
+    }
+}
+'''
+
+
+class TokenizerWorker(object):
+    '''
+    A long-lived PHP process that tokenizes source sent to it over stdin.
+
+    Starting PHP is far more expensive than tokenizing a typical file, so one
+    process is kept running and reused. If the process dies it is restarted
+    and the request is retried once.
+    '''
+    def __init__(self):
+        self.process = None
+
+    def start(self):
+        self.process = subprocess.Popen(['php', '-r', _worker_script], stdin=subprocess.PIPE, stdout=subprocess.PIPE, shell=False, startupinfo=startupinfo)
+
+    def stop(self):
+        if self.process:
+            try:
+                self.process.stdin.close()
+                if self.process.poll() == None:
+                    self.process.kill()
+                self.process.wait()
+            except (IOError, OSError):
+                pass
+            self.process = None
+
+    def ensure_started(self):
+        if self.process == None or self.process.poll() != None:
+            self.start()
+
+    def tokenize(self, source):
+        '''
+        Returns the raw token_get_all() JSON for source (a byte string).
+        '''
+        for attempt in range(0, 2):
+            self.ensure_started()
+            try:
+                self.send('S', source)
+                return self.receive()
+            except (IOError, OSError, ValueError):
+                self.stop()
+                if attempt:
+                    raise
+
+    def tokenize_files(self, filenames):
+        '''
+        Generates (filename, raw token_get_all() JSON) for each file, reading
+        and tokenizing all of them in the worker with a single request.
+
+        The generator must be exhausted or closed before the worker is used
+        again. Closing it early stops the worker so that unread responses are
+        discarded.
+        '''
+        filenames = list(filenames)
+        retried = False
+        while filenames:
+            self.ensure_started()
+            done = False
+            try:
+                try:
+                    self.send('F', '\n'.join([encode_path(f) for f in filenames]))
+                    while filenames:
+                        data = self.receive()
+                        yield filenames.pop(0), data
+                    done = True
+                except (IOError, OSError, ValueError):
+                    if retried:
+                        raise
+                    retried = True
+            finally:
+                if not done:
+                    self.stop()
+
+    def send(self, kind, data):
+        self.process.stdin.write(kind + ' ' + str(len(data)) + '\n')
+        self.process.stdin.write(data)
+        self.process.stdin.flush()
+
+    def receive(self):
+        length = int(self.process.stdout.readline())
+        data = self.process.stdout.read(length)
+        if len(data) != length:
+            raise IOError('Tokenizer worker closed unexpectedly')
+        return data
+
+
+def encode_path(path):
+    if isinstance(path, unicode):
+        return path.encode(sys.getfilesystemencoding() or 'utf-8')
+    return path
+
+
+_workers = threading.local()
+
+
+def get_worker():
+    '''
+    Return the tokenizer worker for the current thread.
+    '''
+    worker = getattr(_workers, 'worker', None)
+    if worker == None:
+        worker = TokenizerWorker()
+        _workers.worker = worker
+    return worker
+
+
+def close_worker():
+    '''
+    Stop the tokenizer worker for the current thread, if there is one.
+    '''
+    worker = getattr(_workers, 'worker', None)
+    if worker:
+        worker.stop()
+        _workers.worker = None
+
+
+def set_tokenizer(name):
+    '''
+    Select the tokenizer backend: 'php' to use token_get_all() in a PHP
+    worker process or 'python' to use the built-in lexer.
+    '''
+    global _tokenizer
+    if name not in ('php', 'python'):
+        print 'SublimePHPIntel: Unknown tokenizer: ' + str(name)
+        name = 'php'
+    _tokenizer = name
+
+
 def get_all_tokens(source=None, filename=None):
     '''
     Returns all of the tokens for a given snippet of code or source file.
     '''
-    tmp = None
     if source:
-        '''Write source to a temp file'''
-        tmp, filename = tempfile.mkstemp()
-        with os.fdopen(tmp, "wb") as f:
-            f.write(source.encode('utf-8'))
-    php = "echo json_encode(token_get_all(file_get_contents('{source}')));".format(source=filename)
-    tokens = subprocess.Popen(['php', '-r', php], bufsize=1, stdout=subprocess.PIPE, shell=False, startupinfo=startupinfo).communicate()[0]
-    tokens = json.loads(tokens)
+        source = source.encode('utf-8')
+    elif filename:
+        with open(filename, 'rb') as f:
+            source = f.read()
+    else:
+        return []
+
+    if _tokenizer == 'python':
+        return phplexer.get_all_tokens(source.decode('utf-8', 'replace'))
+
+    return convert_json_tokens(get_worker().tokenize(source))
+
+
+def get_all_tokens_batch(filenames):
+    '''
+    Generates (filename, tokens) for each of the given source files. With the
+    PHP tokenizer all of the files are tokenized by one worker request.
+    '''
+    if _tokenizer == 'python':
+        for filename in filenames:
+            yield filename, get_all_tokens(filename=filename)
+        return
+
+    for filename, data in get_worker().tokenize_files(filenames):
+        yield filename, convert_json_tokens(data)
+
+
+def convert_json_tokens(data):
+    '''
+    Decode token_get_all() JSON and convert each raw token.
+    '''
+    tokens = json.loads(data)
     for i in range(0, len(tokens)):
         tokens[i] = token(tokens[i])
 
-    if source and tmp:
-        os.unlink(filename)
-
     return tokens
 
 
-def apply_patterns(source, kind):
-    s = sublime.load_settings("SublimePHPIntel.sublime-settings")
-    patterns = s.get(kind)
+def set_patterns(patterns):
+    '''
+    Compile the factory patterns used by apply_patterns(). patterns is a
+    list of settings entries like {"pattern": ..., "class": ..., "capitalize":
+    ...}, applied in order.
+    '''
+    global _patterns
+    compiled = []
     for p in patterns:
-        if p:
+        if p and p.get('pattern'):
             try:
-                m = re.search(p.get('pattern'), source, re.UNICODE)
-                if m:
-                    # Build replacement string with options
-                    c = p.get('class')
-                    for i in range(1,10):
-                        if m.lastindex >= i and c.find('%'+str(i)) >= 0:
-                            value = m.group(i)
-                            if p.get('capitalize'):
-                                value = value[0:1].capitalize() + value[1:]
-                            c = c.replace('%'+str(i), value)
-
-                    # Globally replace match in source
-                    source = source.replace(m.group(0), c)
-            except Exception as e:
+                compiled.append((re.compile(p.get('pattern'), re.UNICODE), p.get('class', ''), p.get('capitalize'), p.get('pattern')))
+            except re.error as e:
                 print e
                 print 'SublimePHPIntel: Invalid pattern: ' + p.get('pattern')
+    _patterns = compiled
+
+
+def apply_patterns(source):
+    '''
+    Replace the first match of each factory pattern in source with the
+    class it produces. The time spent in each pattern is recorded and a
+    pattern that is slow to match is reported once.
+    '''
+    for regex, template, capitalize, pattern in _patterns:
+        started = time.time()
+        m = regex.search(source)
+        if m:
+            # Build replacement string with options
+            c = template
+            for i in range(1, 10):
+                if (m.lastindex or 0) >= i and c.find('%' + str(i)) >= 0:
+                    value = m.group(i) or ''
+                    if capitalize:
+                        value = value[0:1].capitalize() + value[1:]
+                    c = c.replace('%' + str(i), value)
+
+            source = source.replace(m.group(0), c)
+
+        elapsed = time.time() - started
+        entry = _pattern_timings.get(pattern)
+        if entry == None:
+            entry = _pattern_timings[pattern] = [0, 0.0, 0.0]
+        entry[0] += 1
+        entry[1] += elapsed
+        if elapsed > entry[2]:
+            if elapsed > SLOW_PATTERN and entry[2] <= SLOW_PATTERN:
+                print 'SublimePHPIntel: Factory pattern took {ms:.0f}ms: {pattern}'.format(ms=elapsed * 1000, pattern=pattern)
+            entry[2] = elapsed
 
     return source
 
 
-def get_context(source, point):
+def get_pattern_timings():
+    '''
+    Return {pattern: (calls, total seconds, slowest call in seconds)} for
+    every factory pattern applied so far
+    '''
+    timings = {}
+    for pattern, entry in _pattern_timings.items():
+        timings[pattern] = tuple(entry)
+
+    return timings
+
+
+# Code that can hide statement boundaries and class declarations, and the
+# boundaries and declarations themselves
+_code_re = re.compile(r'''
+    "(?:[^"\\]|\\.)*"
+    |'(?:[^'\\]|\\.)*'
+    |/\*.*?(?:\*/|\Z)
+    |(?://|\#).*?(?=\n|\?>|\Z)
+    |<<<[ \t]*["']?(?P<label>[a-zA-Z_]\w*)["']?\r?\n
+    |(?P<close>\?>)
+    |(?<![\w$>:])(?:class|interface|trait)\s+(?P<class>[a-zA-Z_\x80-\xff][\w\x80-\xff]*)
+    |(?P<stop>[;{}])
+''', re.S | re.X | re.I)
+_open_tag_re = re.compile(r'<\?(?:php)?=?', re.I)
+_quote_re = re.compile(r'["\']')
+
+# (source prefix, offset) of the last statement boundary found, so that the
+# next search in the same buffer can resume from there
+_statement_checkpoint = (None, 0)
+
+
+def scan_code(source, pos, end, in_php=True):
+    '''
+    Generates the structure of the PHP code in source between pos and end
+    without tokenizing it. Strings, comments, heredocs and inline HTML are
+    skipped. Each item is (kind, offset, value):
+
+        ('open', end of open tag, None)
+        ('stop', offset after the character, ';' or '{' or '}')
+        ('class', start of the declaration, class name)
+        ('html', offset of close tag, None) when the code ends in HTML
+        ('unclosed', offset of the quote, None) for a string that isn't
+            closed before end, so what follows may turn out to be inside it
+
+    in_php says whether pos is in PHP code or in inline HTML.
+    '''
+    while True:
+        if not in_php:
+            m = _open_tag_re.search(source, pos, end)
+            if not m:
+                return
+            pos = m.end()
+            in_php = True
+            yield 'open', pos, None
+
+        m = _code_re.search(source, pos, end)
+        if not m:
+            return
+        quote = _quote_re.search(source, pos, m.start())
+        if quote:
+            yield 'unclosed', quote.start(), None
+        pos = m.end()
+        if m.group('stop'):
+            yield 'stop', pos, m.group('stop')
+        elif m.group('class'):
+            yield 'class', m.start(), m.group('class')
+        elif m.group('label'):
+            heredoc_end = re.compile('^[ \t]*' + re.escape(m.group('label')) + r'\b', re.M).search(source, pos, end)
+            if not heredoc_end:
+                return
+            pos = heredoc_end.end()
+        elif m.group('close'):
+            in_php = False
+            if not _open_tag_re.search(source, pos, end):
+                yield 'html', m.start(), None
+                return
+
+
+def find_statement_start(source, point):
+    '''
+    Return the offset just past the last statement or block boundary before
+    point that is not inside a string, comment or heredoc, or the start of
+    the PHP block when there is none. Returns None if point is not in PHP
+    code.
+
+    Scanning resumes from the boundary found by the previous call when the
+    source before it has not changed, so repeated calls while typing only
+    scan the new text. Only boundaries that text typed after them can't
+    move are kept: not those after a string that isn't closed yet, nor open
+    tags, which typing can turn from <? into <?php.
+    '''
+    global _statement_checkpoint
+
+    prefix, checkpoint = _statement_checkpoint
+    if prefix != None and checkpoint <= point and source.startswith(prefix):
+        start = checkpoint
+        code = scan_code(source, checkpoint, point)
+    else:
+        start = None
+        code = scan_code(source, 0, point, in_php=False)
+
+    settled = start
+    unclosed = False
+    for kind, offset, value in code:
+        if kind == 'unclosed':
+            unclosed = True
+        elif kind == 'stop' or kind == 'open':
+            start = offset
+            if kind == 'stop' and not unclosed:
+                settled = offset
+        elif kind == 'html':
+            return None
+
+    if settled != None:
+        _statement_checkpoint = (source[:settled], settled)
+
+    return start
+
+
+def get_class_spans(source):
+    '''
+    Return (start, end, name, depth) for each class, interface and trait
+    declared in source, ordered by start. depth is the brace depth of the
+    declaration's body. A declaration that is never closed ends at the end of
+    the source.
+    '''
+    return scan_class_spans(source)[0]
+
+
+def scan_class_spans(source, pos=0, state=(0, (), True), resync=None):
+    '''
+    Return the class spans of source, as get_class_spans() does, and the
+    state of the scan just after each brace, which update_class_spans()
+    restarts from. Each checkpoint is (offset, depth, stack, settled):
+    stack holds (start, name, depth) for the declarations open at offset,
+    and settled is False once a string that isn't closed has been skipped,
+    because text added after that may close it and change everything after
+    the quote.
+
+    Scanning starts in inline HTML at offset 0, or just after a brace with
+    the given (depth, stack, settled) state. resync(checkpoint) is called
+    at each brace and scanning stops as soon as it returns something other
+    than None, which is returned as the third item. Otherwise the third item
+    is None.
+    '''
+    depth, frozen, settled = state
+    stack = list(frozen)
+    spans = []
+    checkpoints = []
+    pending = None
+    for kind, offset, value in scan_code(source, pos, len(source), in_php=pos > 0):
+        if kind == 'class':
+            pending = (offset, value)
+        elif kind == 'unclosed':
+            settled = False
+        elif kind == 'stop' and value != ';':
+            if value == '{':
+                depth += 1
+                if pending:
+                    stack.append((pending[0], pending[1], depth))
+                    frozen = tuple(stack)
+                    pending = None
+            else:
+                if stack and stack[-1][2] == depth:
+                    start, name, d = stack.pop()
+                    frozen = tuple(stack)
+                    spans.append((start, offset, name, d))
+                depth -= 1
+            if pending == None:
+                # Checkpoints share the stack until it changes
+                checkpoint = (offset, depth, frozen, settled)
+                checkpoints.append(checkpoint)
+                if resync:
+                    resumed = resync(checkpoint)
+                    if resumed != None:
+                        spans.sort()
+                        return spans, checkpoints, resumed
+
+    for start, name, d in stack:
+        spans.append((start, len(source), name, d))
+    spans.sort()
+
+    return spans, checkpoints, None
+
+
+def update_class_spans(old_source, old_spans, old_checkpoints, source):
+    '''
+    Return the class spans and checkpoints of source given those of an
+    earlier version of it, as scan_class_spans() does. Scanning restarts at
+    the last brace before the first changed character, and stops at the
+    first brace after the last changed character where the state of the
+    scan is the same as it was at that brace before: the rest of the old
+    spans and checkpoints are then moved by the change in length.
+    '''
+    # Length of the common prefix and of the common suffix that doesn't
+    # overlap it, by binary search
+    low = 0
+    high = min(len(old_source), len(source))
+    while low < high:
+        middle = (low + high + 1) // 2
+        if source.startswith(old_source[:middle]):
+            low = middle
+        else:
+            high = middle - 1
+    suffix = 0
+    high = min(len(old_source), len(source)) - low
+    while suffix < high:
+        middle = (suffix + high + 1) // 2
+        if source.endswith(old_source[len(old_source) - middle:]):
+            suffix = middle
+        else:
+            high = middle - 1
+    delta = len(source) - len(old_source)
+
+    def moved(offset):
+        return offset if offset < low else offset + delta
+
+    moved_stacks = {}
+
+    def move_stack(stack):
+        key = id(stack)
+        if key not in moved_stacks:
+            moved_stacks[key] = tuple([(moved(start), name, d) for start, name, d in stack])
+        return moved_stacks[key]
+
+    # Restart from the last settled checkpoint before the change
+    k = bisect.bisect_right(old_checkpoints, (low, float('inf'))) - 1
+    while k >= 0 and not old_checkpoints[k][3]:
+        k -= 1
+    if k < 0:
+        pos = 0
+        state = (0, (), True)
+        kept_spans = []
+    else:
+        pos, depth, stack, settled = old_checkpoints[k]
+        state = (depth, stack, settled)
+        kept_spans = [span for span in old_spans if span[1] <= pos and (span[0], span[2], span[3]) not in stack]
+    kept_checkpoints = old_checkpoints[:k + 1]
+
+    # Resume from the old scan at a brace in the unchanged end of the source
+    # with the same state
+    changed_end = len(source) - suffix
+    following = [k + 1]
+
+    def resync(checkpoint):
+        offset, depth, stack, settled = checkpoint
+        if offset < changed_end or offset >= len(source):
+            return None
+        j = following[0]
+        while j < len(old_checkpoints) and old_checkpoints[j][0] < offset - delta:
+            j += 1
+        following[0] = j
+        if j == len(old_checkpoints):
+            return None
+        old_offset, old_depth, old_stack, old_settled = old_checkpoints[j]
+        if old_offset == offset - delta and old_depth == depth and old_settled == settled and move_stack(old_stack) == stack:
+            return j
+        return None
+
+    spans, checkpoints, j = scan_class_spans(source, pos, state, resync)
+    if j == None:
+        return sorted(kept_spans + spans), kept_checkpoints + checkpoints
+
+    resumed_at = old_checkpoints[j][0]
+    spans += [(moved(start), end + delta, name, d) for start, end, name, d in old_spans if end > resumed_at]
+    checkpoints += [(offset + delta, depth, move_stack(stack), settled) for offset, depth, stack, settled in old_checkpoints[j + 1:]]
+
+    return sorted(kept_spans + spans), kept_checkpoints + checkpoints
+
+
+def find_enclosing_class(spans, point, size=None):
+    '''
+    Return the name of the innermost class span containing point. size is
+    the length of the source: a span that ends there hasn't been closed yet,
+    so a point at its end, where the next character will be typed, is still
+    inside it.
+    '''
+    name = None
+    for start, end, span_name, depth in spans:
+        if start > point:
+            break
+        if point < end or (point == end and end == size):
+            name = span_name
+
+    return name
+
+
+def get_context(source, point, class_at=None):
     '''
     Given a snippet of code, return a list of tokens for the classes and
     functions within the last statement. For example, given code:
@@ -159,21 +691,34 @@ def get_context(source, point):
         ['$class', 'setAlpha']
 
     Steps:
-        - Replace all factory regexs in the source defined in the settings.
+        - Find where the last statement starts, so that only the code from
+          there to the point needs to be tokenized.
+        - Replace all factory regexs in the statement defined in the settings.
         - Read the list backwards until we get to an enclosing block or the previous statement.
         - Create the context from that point and forward.
+
+    class_at is an optional function that returns the name of the class
+    declared around a given point. It is used to resolve $this.
     '''
 
     fullsource = source
     source = source[:point]
 
-    source = apply_patterns(source, 'customfactories')
-    source = apply_patterns(source, 'factories')
+    start = find_statement_start(fullsource, point)
+    if start == None:
+        return [], None, None
+
+    tail = '<?php ' + fullsource[start:point]
+    started = timing.start()
+    tail = apply_patterns(tail)
+    timing.stop('completion.apply_patterns', started)
 
     visibility = None
     context = []
     operator = None
-    tokens = get_all_tokens(source)
+    started = timing.start()
+    tokens = get_all_tokens(tail)
+    timing.stop('completion.tokenize', started)
     tokens.reverse()
     nest = 0
     end = 0
@@ -230,9 +775,11 @@ def get_context(source, point):
     if context and context[0].startswith('$'):
         class_name = None
         if context[0].startswith('$this'):
-            tokens = convert_raw_tokens(get_all_tokens(fullsource))
-            class_name = tokens[0]['class'] if tokens else None
-        
+            if class_at:
+                class_name = class_at(point)
+            else:
+                class_name = find_enclosing_class(get_class_spans(fullsource), point, len(fullsource))
+
         if class_name == None:
             searchtext = context[0].replace('$', '\$')
             searchtext = searchtext.replace('(', '\(')
@@ -247,90 +794,246 @@ def get_context(source, point):
     return context, visibility, operator
 
 
-def convert_raw_tokens(raw_tokens):
+_strings = {}
+
+
+def intern_string(s):
+    '''
+    Return a shared copy of s so that repeated names such as classes,
+    parents and types are only held in memory once.
+    '''
+    return _strings.setdefault(s, s)
+
+
+class Declaration(tuple):
+    '''
+    A class, function or member variable declaration.
+
+    Declarations are tuples so that they are small in memory and in the
+    index. 'class_name' is '__global__' for functions outside of a class,
+    'static' is a bool and 'args' is a tuple of (name, type) pairs. 'line' is
+    the line the member is declared on, or the line of the class declaration
+    for the entry describing the class itself.
+    '''
+    __slots__ = ()
+
+    fields = ('class_name', 'extends', 'implements', 'visibility', 'static', 'kind', 'name', 'args', 'returns', 'line', 'path')
+
+    def __new__(cls, class_name='__global__', extends='', implements='', visibility='public', static=False, kind='', name='', args=(), returns='', line=0, path=''):
+        return tuple.__new__(cls, (
+            intern_string(class_name),
+            intern_string(extends),
+            intern_string(implements),
+            intern_string(visibility),
+            bool(static),
+            intern_string(kind),
+            intern_string(name),
+            tuple([(intern_string(n), intern_string(t)) for n, t in args]),
+            intern_string(returns),
+            line,
+            intern_string(path),
+        ))
+
+    def __getnewargs__(self):
+        return tuple(self)
+
+    def __repr__(self):
+        return 'Declaration(%s)' % ', '.join(['%s=%r' % (f, v) for f, v in zip(self.fields, self)])
+
+    def replace(self, **fields):
+        '''
+        Return a copy of the declaration with some fields changed
+        '''
+        values = dict(zip(self.fields, self))
+        values.update(fields)
+        return Declaration(**values)
+
+    def to_dict(self):
+        '''
+        Return the declaration as a dictionary, with 'class' for the class
+        name, for JSON output
+        '''
+        d = dict(zip(self.fields, self))
+        d['class'] = d.pop('class_name')
+        d['args'] = [list(a) for a in d['args']]
+        return d
+
+    @classmethod
+    def from_dict(cls, d):
+        '''
+        Convert a declaration saved by older versions, which used a
+        dictionary for each declaration
+        '''
+        return cls(
+            d.get('class') or '__global__',
+            d.get('extends') or '',
+            d.get('implements') or '',
+            d.get('visibility') or 'public',
+            str(d.get('static')) == '1',
+            d.get('kind') or '',
+            d.get('name') or '',
+            d.get('args') or (),
+            d.get('returns') or '',
+            d.get('line', 0),
+            d.get('path') or '',
+        )
+
+    class_name = property(lambda self: self[0])
+    extends = property(lambda self: self[1])
+    implements = property(lambda self: self[2])
+    visibility = property(lambda self: self[3])
+    static = property(lambda self: self[4])
+    kind = property(lambda self: self[5])
+    name = property(lambda self: self[6])
+    args = property(lambda self: self[7])
+    returns = property(lambda self: self[8])
+    line = property(lambda self: self[9])
+    path = property(lambda self: self[10])
+
+
+def upgrade_declarations(declarations):
+    '''
+    Convert a list of declarations saved in the old dictionary format
+    '''
+    if declarations and isinstance(declarations[0], dict):
+        return [Declaration.from_dict(d) for d in declarations]
+    return declarations
+
+
+def convert_raw_tokens(raw_tokens, path=''):
     '''
     Converts raw tokens into an array of class, function, and member
-    variable declarations.
+    variable declarations. Each definition is a Declaration.
 
-    Each definition is a dictionary object with keys for its attributes.
+    The tokens are read in a single pass. The names that follow keywords
+    such as class, function and extends are picked up by the state machine
+    as it reaches them, and function bodies are skipped over.
     '''
     nest = 0
     in_class = False
+    in_header = False
     class_name = None
+    class_line = 0
+    extends = None
+    implements = []
+    expect = None
     kind = None
     visibility = None
     static = False
     name = None
-    extends = None
-    implements = None
+    name_line = 0
     args = []
-    in_args = False
-    returns = None
+    parens = 0
     doc = None
+    previous = None
     declarations = []
 
-    def save():
-        if class_name or name:
-            fields = {
-                'class': unicode(class_name) if class_name else '__global__',
-                'extends': unicode(extends) if extends else '',
-                'implements': unicode(implements) if implements else '',
-                'visibility': unicode(visibility) if visibility else 'public',
-                'static': '1' if static else '0',
-                'kind': unicode(kind) if kind else '',
-                'name': unicode(name) if name else '',
-                'args': args,
-                'returns': unicode(returns) if returns else '',
-                'doc': unicode(doc) if doc else '',
-            }
-            declarations.append(fields)
-
-    def search_ahead(n, search):
-        for i in range(n, len(raw_tokens)):
-            t, stmt, line = raw_tokens[i]
-            if t == search:
-                return stmt
-            
-    n = 0
+    def save(name, line):
+        returns = None
+        if kind == 'func' and name == '__construct' and class_name:
+            returns = class_name
+        if name and doc:
+            tag = '@return' if kind == 'func' else '@var'
+            data = re.findall(tag + '\s+([\w|\||\$]*?)[\s|$]', doc)
+            if data:
+                returns = data[0]
+        declarations.append(Declaration(
+            class_name or '__global__',
+            extends or '',
+            ','.join([i for i in implements if i]),
+            visibility or 'public',
+            static,
+            kind or '',
+            name or '',
+            args,
+            returns or '',
+            line,
+            path,
+        ))
+
     for t, stmt, line in raw_tokens:
-        if t == 'T_WHITESPACE':
-            pass
-        elif stmt == '{':
+        if t == 'T_WHITESPACE' or t == 'T_COMMENT':
+            continue
+
+        if parens:
+            # Function arguments
+            if stmt == '(':
+                parens += 1
+            elif stmt == ')':
+                parens -= 1
+            elif t == 'T_VARIABLE' and parens == 1:
+                vtype = ''
+                if doc:
+                    v = stmt.replace('$', '')
+                    data = re.findall('@param\s+([\w|\||\$]*?)\s+\$' + v + '[\s|$]', doc)
+                    if data:
+                        vtype = data[0]
+                args.append((stmt, vtype))
+        elif stmt == '{' or t == 'T_CURLY_OPEN' or t == 'T_DOLLAR_OPEN_CURLY_BRACES':
+            if in_header:
+                in_header = False
+                in_class = True
+                expect = None
+            elif expect == 'use':
+                # Conflict resolution for the traits a class uses
+                expect = None
+            elif kind == 'func' and name and nest == int(in_class):
+                save(name, name_line)
+                kind = name = visibility = doc = expect = None
+                static = False
+                args = []
             nest += 1
         elif stmt == '}':
             nest -= 1
-            if nest == 0:
-                save()
-                visibility = None
-                kind = None
-                in_class = False
-                class_name = None
-                extends = None
-                implements = None
-                name = None
-                args = []
-                in_args = False
+            if in_class and nest == 0:
+                kind = name = visibility = doc = expect = None
                 static = False
-                doc = None
-                returns = None
-            if in_class and nest == 1:
-                save()
-                visibility = None
-                kind = None
-                name = None
                 args = []
-                in_args = False
-                static = False
-                doc = None
-                returns = None
-        elif t == None and stmt == ';' and in_class and nest == 1:
-            save()
-            visibility = None
-            kind = None
-            name = None
-            static = False
-            returns = None
-            doc = None
+                save(None, class_line)
+                in_class = False
+                class_name = extends = None
+                implements = []
+        elif nest != int(in_class):
+            # Inside a function body
+            pass
+        elif t == 'T_STRING' and expect in ('class', 'func', 'const'):
+            if expect == 'class':
+                class_name, class_line = stmt, line
+            else:
+                name, name_line = stmt, line
+            expect = None
+        elif in_header:
+            # Only the last part of a namespaced name is kept
+            if t == 'T_EXTENDS':
+                expect = 'extends'
+            elif t == 'T_IMPLEMENTS':
+                expect = 'implements'
+                implements.append('')
+            elif stmt == ',' and expect == 'implements':
+                implements.append('')
+            elif t == 'T_STRING' and expect == 'extends':
+                extends = stmt
+            elif t == 'T_STRING' and expect == 'implements':
+                implements[-1] = stmt
+        elif expect == 'use':
+            # Members of the traits a class uses are looked up like those of
+            # the interfaces it implements
+            if stmt == ';':
+                expect = None
+            elif stmt == ',':
+                implements.append('')
+            elif t == 'T_STRING':
+                implements[-1] = stmt
+        elif t == 'T_USE' and in_class:
+            expect = 'use'
+            implements.append('')
+        elif (t == 'T_CLASS' or t == 'T_INTERFACE' or t == 'T_TRAIT') and not in_class and previous not in ('T_NEW', 'T_DOUBLE_COLON'):
+            in_header = True
+            expect = 'class'
+            class_name = None
+            class_line = line
+        elif t == 'T_DOC_COMMENT':
+            doc = stmt
         elif t == 'T_PUBLIC':
             visibility = 'public'
         elif t == 'T_PROTECTED':
@@ -339,57 +1042,31 @@ def convert_raw_tokens(raw_tokens):
             visibility = 'private'
         elif t == 'T_STATIC':
             static = True
-        elif t == 'T_DOC_COMMENT':
-            doc = stmt
-        elif t == 'T_VARIABLE' and kind == None and in_class and nest == 1 and name == None:
-            kind = 'var'
-            name = stmt
-            args = []
-            if doc:
-                data = re.findall('@var\s+([\w|\||\$]*?)[\s|$]', doc)
-                if data:
-                    returns = data[0]
+        elif t == 'T_FUNCTION':
+            kind = 'func'
+            expect = 'func'
         elif t == 'T_CONST':
             kind = 'var'
-            name = search_ahead(n, 'T_STRING')
-            args = []
+            expect = 'const'
             static = True
-            if doc:
-                data = re.findall('@var\s+([\w|\||\$]*?)[\s|$]', doc)
-                if data:
-                    returns = data[0]
-        elif t == 'T_FUNCTION':
-            kind = 'func'
-            name = search_ahead(n, 'T_STRING')
-            if name == '__construct' and class_name:
-                returns = class_name
-            if doc:
-                data = re.findall('@return\s+([\w|\||\$]*?)[\s|$]', doc)
-                if data:
-                    returns = data[0]
-        elif kind == 'func' and stmt == '(' and not args and (nest == 0 or in_class and nest == 1):
-            in_args = True
-        elif kind == 'func' and stmt == ')' and in_args:
-            in_args = False
-        elif kind == 'func' and t == 'T_VARIABLE' and in_args:
-            vtype = ''
-            if doc:
-                v = stmt.replace('$', '')
-                data = re.findall('@param\s+([\w|\||\$]*?)\s+\$' + v + '[\s|$]', doc)
-                if data:
-                    vtype = data[0]
-            args.append([stmt, vtype])
-        elif t == 'T_CLASS':
-            in_class = True
-            class_name = search_ahead(n, 'T_STRING')
-        elif t == 'T_INTERFACE':
-            class_name = search_ahead(n, 'T_STRING')
-        elif t == 'T_EXTENDS':
-            extends = search_ahead(n, 'T_STRING')
-        elif t == 'T_IMPLEMENTS':
-            implements = search_ahead(n, 'T_STRING')
-
-        n += 1
+        elif t == 'T_VARIABLE' and in_class and kind == None:
+            kind = 'var'
+            name, name_line = stmt, line
+        elif stmt == '(' and kind == 'func':
+            if name:
+                parens = 1
+            else:
+                # Closure
+                kind = visibility = doc = expect = None
+                static = False
+        elif stmt == ';':
+            if name:
+                save(name, name_line)
+            kind = name = visibility = doc = expect = None
+            static = False
+            args = []
+
+        previous = t
 
     return declarations
 
@@ -403,36 +1080,70 @@ def scan_file(filename, extension='.php'):
 
     name, ext = os.path.splitext(filename)
     if ext == extension:
+        started = timing.start()
         raw_tokens = get_all_tokens(filename=filename)
-        declarations = convert_raw_tokens(raw_tokens)
-
-        for i in range(0, len(declarations)):
-            declarations[i]['path'] = filename
+        timing.stop('scan.tokenize', started)
+        started = timing.start()
+        declarations = convert_raw_tokens(raw_tokens, filename)
+        timing.stop('scan.convert', started)
 
     return declarations
 
 
-def scan_all_files(base_folder, extension='.php'):
+def scan_files(filenames, extension='.php'):
+    '''
+    Generates (filename, declarations) for each of the given PHP source
+    files, tokenizing them as a batch.
+    '''
+    filenames = [f for f in filenames if os.path.splitext(f)[1] == extension]
+    started = timing.start()
+    for filename, raw_tokens in get_all_tokens_batch(filenames):
+        timing.stop('scan.tokenize', started)
+        started = timing.start()
+        declarations = convert_raw_tokens(raw_tokens, filename)
+        timing.stop('scan.convert', started)
+        yield filename, declarations
+        started = timing.start()
+
+
+def find_files(base_folder, extension='.php', exclude=None, exclude_folder=None):
+    '''
+    Generates the path of every source file below base_folder, skipping any
+    path for which exclude(path) returns True. Folders for which
+    exclude_folder(path) returns True are skipped without being listed.
+    '''
+    for root, dirs, files in os.walk(base_folder, followlinks=True):
+        if exclude_folder:
+            dirs[:] = [d for d in dirs if not exclude_folder(os.path.join(root, d))]
+        for name in files:
+            if os.path.splitext(name)[1] == extension:
+                path = os.path.join(root, name)
+                if exclude and exclude(path):
+                    continue
+                yield path
+
+
+def scan_all_files(base_folder, extension='.php', batch_size=100):
     '''
     Returns array of class, function, and member declarations for all of the
     PHP source files on a given path.
     '''
     declarations = []
-    for root, dirs, files in os.walk(base_folder):
-        for name in files:
-            filename, ext = os.path.splitext(name)
-            if ext == extension:
-                path = os.path.join(root, name)
-                sys.stderr.write(path + '\n')
-                declarations.extend(scan_file(path))
+    batch = []
 
-    return declarations
+    def scan_batch():
+        for path, d in scan_files(batch, extension):
+            sys.stderr.write(path + '\n')
+            declarations.extend(d)
 
+    for path in find_files(base_folder, extension):
+        batch.append(path)
+        if len(batch) >= batch_size:
+            scan_batch()
+            del batch[:]
+    scan_batch()
 
-'''
-Initialization
-'''
-get_all_token_names()
+    return declarations
 
 
 if __name__ == '__main__':
@@ -445,8 +1156,8 @@ if __name__ == '__main__':
     if os.path.isdir(filename):
         declarations = scan_all_files(filename)
         for d in declarations:
-            sys.stdout.write(json.dumps(d))
+            sys.stdout.write(json.dumps(d.to_dict()))
 
     else:
         declarations = scan_file(filename)
-        print json.dumps(declarations)
+        print json.dumps([d.to_dict() for d in declarations])
@@ -0,0 +1,230 @@
+'''
+SublimePHPIntel for Sublime Text 2
+Copyright 2012 John Watson <https://github.com/jotson>
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights to
+use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of
+the Software, and to permit persons to whom the Software is furnished to do so,
+subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+'''
+
+import time
+import os
+import threading
+import timing
+
+# Scan priorities, most urgent first: files saved in the editor, files
+# changed outside of it and whole project scans
+INTERACTIVE = 0
+BACKGROUND = 1
+PROJECT = 2
+
+PRIORITY_NAMES = {INTERACTIVE: 'interactive', BACKGROUND: 'background', PROJECT: 'project'}
+
+
+class ScanQueue(object):
+    '''
+    Pending scan work, ordered by priority and then by age.
+
+    Work is either a scan of whole project folders, queued as '__all__', or
+    a file. A file that is queued again before it has been scanned keeps a
+    single entry with the higher of the two priorities and the earlier queue
+    time. While a project scan of a folder is waiting, files in it queued in
+    the background are left to it, because it will find them changed
+    anyway.
+    '''
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.files = {}
+        # Number of files queued at each priority
+        self.counts = [0, 0]
+        # folder -> (sequence, queue time) of its project scan
+        self.projects = {}
+        self.sequence = 0
+        self.waits = {}
+
+    def add(self, path, priority=None, folders=()):
+        '''
+        Queue path, which is a file name or a sequence of file names, or
+        '__all__' to scan the given project folders
+        '''
+        now = time.time()
+        with self.lock:
+            if path == '__all__':
+                for folder in folders:
+                    if folder not in self.projects:
+                        self.sequence += 1
+                        self.projects[folder] = (self.sequence, now)
+                for filename, entry in self.files.items():
+                    if entry[0] >= BACKGROUND and self.in_project(filename):
+                        del self.files[filename]
+                        self.counts[entry[0]] -= 1
+                return
+
+            if isinstance(path, basestring):
+                path = [path]
+            if priority == None:
+                priority = INTERACTIVE
+            for filename in path:
+                entry = self.files.get(filename)
+                if entry:
+                    if priority < entry[0]:
+                        self.counts[entry[0]] -= 1
+                        self.counts[priority] += 1
+                        entry[0] = priority
+                elif priority >= BACKGROUND and self.in_project(filename):
+                    continue
+                else:
+                    self.sequence += 1
+                    self.files[filename] = [priority, self.sequence, now]
+                    self.counts[priority] += 1
+
+    def pop(self, limit=None, prefix=None, priority=PROJECT):
+        '''
+        Take the most urgent work of at least the given priority from the
+        queue. Returns ('files', paths, priority) with up to limit files of
+        the same priority, oldest first, ('__all__', folders, PROJECT) for a
+        project scan of every folder waiting for one, or None. Only files starting with
+        prefix are taken when it is given.
+        '''
+        now = time.time()
+        with self.lock:
+            if not sum(self.counts[:priority + 1]) and not (self.projects and priority >= PROJECT):
+                return None
+            entries = [(entry[0], entry[1], filename) for filename, entry in self.files.items() if entry[0] <= priority and (prefix == None or filename.startswith(prefix))]
+            if entries:
+                entries.sort()
+                urgent = entries[0][0]
+                paths = [filename for p, sequence, filename in entries if p == urgent][:limit]
+                self.counts[urgent] -= len(paths)
+                for filename in paths:
+                    self.record_wait(urgent, now - self.files.pop(filename)[2])
+                return 'files', paths, urgent
+
+            if self.projects and prefix == None and priority >= PROJECT:
+                folders = sorted(self.projects.keys(), key=lambda folder: self.projects[folder][0])
+                for folder in folders:
+                    self.record_wait(PROJECT, now - self.projects[folder][1])
+                self.projects = {}
+                return '__all__', folders, PROJECT
+
+        return None
+
+    def has_work(self, priority=PROJECT):
+        with self.lock:
+            if priority >= PROJECT and self.projects:
+                return True
+            return sum(self.counts[:priority + 1]) > 0
+
+    def in_project(self, filename):
+        '''
+        Returns True if a project scan is waiting for the folder of filename
+        '''
+        for folder in self.projects:
+            if filename.startswith(folder + os.sep):
+                return True
+        return False
+
+    def record_wait(self, priority, waited):
+        name = PRIORITY_NAMES[priority]
+        wait = self.waits.get(name)
+        if wait == None:
+            wait = self.waits[name] = [0, 0.0, 0.0]
+        wait[0] += 1
+        wait[1] += waited
+        wait[2] = max(wait[2], waited)
+        if timing.is_enabled():
+            timing.stop('scan.wait.' + name, time.time() - waited)
+
+    def __len__(self):
+        with self.lock:
+            return len(self.files) + len(self.projects)
+
+    def stats(self):
+        '''
+        Return the number of files waiting at each priority, the folders
+        waiting for a project scan, how long the oldest entry has waited, and
+        the number, mean and longest waits of the entries taken so far.
+        Times are in seconds.
+        '''
+        now = time.time()
+        with self.lock:
+            queued = {}
+            oldest = 0.0
+            for priority, sequence, queued_at in self.files.values():
+                name = PRIORITY_NAMES[priority]
+                queued[name] = queued.get(name, 0) + 1
+                oldest = max(oldest, now - queued_at)
+            for sequence, queued_at in self.projects.values():
+                oldest = max(oldest, now - queued_at)
+            waits = {}
+            for name, (count, total, longest) in self.waits.items():
+                waits[name] = {'count': count, 'mean': total / count, 'max': longest}
+
+            return {
+                'queued': queued,
+                'project_scan_queued': sorted(self.projects.keys()),
+                'oldest_wait': oldest,
+                'waits': waits,
+            }
+
+
+class Throttle(object):
+    '''
+    Limits the CPU time spent by the threads that share it to budget, a
+    share between 0 and 1 of cpus CPU cores. Each thread calls tick() after every
+    piece of work, and resume() when it starts working again after waiting
+    for something, so that the wait isn't counted as work. After a slice of
+    work a thread rests until the work of all of the threads fits in the
+    budget.
+    '''
+    SLICE = 0.05
+
+    def __init__(self, budget=1.0, cpus=1):
+        self.budget = budget
+        self.cpus = cpus
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        # The time by which the work reported so far fits in the budget
+        self.clock = 0.0
+
+    def resume(self):
+        self.local.started = time.time()
+        if getattr(self.local, 'since', None) == None:
+            self.local.since = self.local.started
+
+    def tick(self):
+        if self.budget >= 1 or self.budget <= 0:
+            return
+        now = time.time()
+        started = getattr(self.local, 'started', None)
+        self.local.started = now
+        if started == None:
+            self.local.since = now
+            return
+        busy = getattr(self.local, 'busy', 0.0) + now - started
+        if busy < self.SLICE:
+            self.local.busy = busy
+            return
+        self.local.busy = 0.0
+        with self.lock:
+            # Waits since the slice began count as rest, and the work of
+            # other threads has to fit in the budget first
+            self.clock = max(self.clock, self.local.since) + busy / (self.budget * self.cpus)
+            until = self.clock
+        if until > now:
+            time.sleep(until - now)
+        self.local.started = self.local.since = time.time()
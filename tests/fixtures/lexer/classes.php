@@ -0,0 +1,70 @@
+<?php
+namespace Acme\Billing;
+
+use Acme\Core\Model;
+use Acme\Core\Events\Dispatcher as Events;
+
+/**
+ * An invoice and its lines
+ */
+abstract class Invoice extends Model implements \Countable, \IteratorAggregate
+{
+    const STATUS_DRAFT = 'draft';
+    const RATE = 0.2;
+
+    public static $instances = 0;
+    protected $lines = array();
+    private $total = 0, $number;
+    var $legacy;
+
+    /**
+     * @param string $number
+     * @return Invoice
+     */
+    public function __construct($number, array $lines = [], Events $events = null)
+    {
+        parent::__construct();
+        self::$instances++;
+        static::boot($events);
+        $this->number = $number;
+        foreach ($lines as $key => $line) {
+            $this->lines[$key] = clone $line;
+        }
+    }
+
+    abstract protected function tax($amount);
+
+    final public function count()
+    {
+        return count($this->lines);
+    }
+
+    public function getIterator()
+    {
+        return new \ArrayIterator($this->lines);
+    }
+
+    public static function create($number)
+    {
+        $invoice = new static($number);
+        return $invoice instanceof self ? $invoice : null;
+    }
+}
+
+interface Payable
+{
+    public function pay($amount, $currency = 'EUR');
+}
+
+trait Discounts
+{
+    public function discount($percent)
+    {
+        return $this->total - $this->total * $percent / 100;
+    }
+}
+
+function helper($value)
+{
+    return namespace\format($value) . \strtoupper(__NAMESPACE__) . __CLASS__ . __FUNCTION__ . __LINE__;
+}
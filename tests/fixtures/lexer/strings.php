@@ -0,0 +1,23 @@
+<?php
+$name = 'World';
+$single = 'It\'s a \\ test $name';
+$double = "Hello $name\n";
+$braces = "Total: {$order->total} of ${name} and {$items['first']}";
+$offsets = "Item $items[0] $items[key] $items[$i] $items[-1] $obj->prop->other";
+$escaped = "Not \$interpolated and \"quoted\"";
+$binary = b'bytes';
+$heredoc = <<<EOT
+Dear $name,
+  Your total is {$order->total()}.
+EOT;
+$quoted = <<<"EOT"
+Quoted $name
+EOT;
+$nowdoc = <<<'EOT'
+Nothing $here is {$interpolated}
+EOT;
+$shell = `ls -la $dir`;
+$empty = "";
+$multi = 'one
+two';
+echo "$name's", "{$name}s";
@@ -0,0 +1,39 @@
+<html>
+<body>
+<?php if ($user): ?>
+  <p><?= $user->name ?></p>
+<?php else: ?>
+  <p>Guest</p>
+<?php endif; ?>
+<?php
+// A line comment
+# A hash comment
+/* A block
+   comment */
+$a = (int) $b + (float)$c - ( string )$d . (bool) $e . (array) $f . (object) $g;
+$h = 0x1F + 0b101 + 017 + 1.5e3 + .5 + 1_000;
+$i = $a <=> $b;
+$j = $a ?? $b;
+$k **= 2;
+$l = $a === $b && $c !== $d || !$e;
+$m <<= 1; $n >>= 1; $o .= 'x'; $p %= 3; $q &= 1; $r |= 2; $s ^= 3;
+$t = function ($x) use (&$y) { return $x + $y; };
+$u = [1, 2, 3];
+list($v, $w) = $u;
+$x = isset($a) && empty($b);
+$y = $obj->class->list->function();
+$z = Foo::class;
+while ($i-- > 0) { continue; }
+do { break; } while (false);
+for ($i = 0; $i < 10; $i++) {}
+switch ($a) { case 1: break; default: return; }
+try { throw new \Exception('x'); } catch (\Exception $e) {} finally {}
+declare(ticks=1);
+goto end;
+end:
+global $config;
+unset($a);
+print 'done';
+exit(0);
+?>
+<footer></footer>
@@ -0,0 +1,38 @@
+<?php
+namespace Acme\Billing;
+
+trait Discounts
+{
+    protected $rate = 0;
+
+    /**
+     * @return float
+     */
+    public function discount($percent)
+    {
+        return $this->total - $this->total * $percent / 100;
+    }
+}
+
+trait Rounding
+{
+    public static function round($amount)
+    {
+        $round = function ($value) use ($amount) {
+            return floor($value);
+        };
+        return $round($amount);
+    }
+}
+
+class Invoice
+{
+    use Discounts, \Acme\Billing\Rounding {
+        Rounding::round as protected roundTotal;
+    }
+
+    public function total()
+    {
+        return static::class;
+    }
+}
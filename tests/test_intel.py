@@ -0,0 +1,67 @@
+'''
+Tests for the intel stores:
+
+    python -m unittest discover tests
+'''
+
+import os
+import sys
+import shutil
+import pickle
+import tempfile
+import unittest
+
+tests_folder = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(tests_folder))
+
+import intel
+import phpparser
+
+
+class RelocateTest(unittest.TestCase):
+    def setUp(self):
+        self.backend = intel._store_backend
+        self.folder = tempfile.mkdtemp()
+
+    def tearDown(self):
+        intel.set_store_backend(self.backend)
+        intel.reset()
+        intel._stores.clear()
+        intel._cache.clear()
+        shutil.rmtree(self.folder)
+
+    def build(self, backend):
+        '''
+        Save intel for a file in one checkout, copy it into another and
+        return the declarations saved and those loaded in the copy
+        '''
+        intel.set_store_backend(backend)
+        intel._stores.clear()
+        built = os.path.join(self.folder, 'built')
+        copy = os.path.join(self.folder, 'copy')
+        declarations = [phpparser.Declaration('Foo', kind='func', name='bar', line=3, path=os.path.join(built, 'src', 'Foo.php'))]
+        intel.save(declarations, built, os.path.join(built, 'src', 'Foo.php'))
+        intel.commit(built)
+        shutil.copytree(os.path.join(built, '.phpintel'), os.path.join(copy, '.phpintel'))
+        intel._stores.clear()
+        intel._cache.clear()
+        return built, intel.load(copy, os.path.join(copy, 'src', 'Foo.php'))
+
+    def test_files_store(self):
+        built, loaded = self.build('files')
+        self.assertEqual([os.path.join(self.folder, 'copy', 'src', 'Foo.php')], [d.path for d in loaded])
+        store = intel.get_store(built)
+        with open(store.get_path(os.path.join(built, 'src', 'Foo.php')), 'rb') as f:
+            self.assertEqual(['src/Foo.php'], [d.path for d in pickle.load(f)])
+
+    def test_sqlite_store(self):
+        if intel.sqlite3 == None:
+            self.skipTest('sqlite3 is not available')
+        built, loaded = self.build('sqlite')
+        self.assertEqual([os.path.join(self.folder, 'copy', 'src', 'Foo.php')], [d.path for d in loaded])
+        row = intel.get_store(built).connect().execute('SELECT data FROM declarations').fetchone()
+        self.assertEqual(['src/Foo.php'], [d.path for d in pickle.loads(str(row[0]))])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,218 @@
+'''
+Checks the pure Python lexer against the expected tokens of the edge cases
+in CASES, and against PHP's own token_get_all() on those cases and on the
+fixtures in fixtures/lexer. The parity tests need the php binary on your
+path and are skipped without it:
+
+    python -m unittest discover tests
+'''
+
+import os
+import sys
+import glob
+import subprocess
+import unittest
+
+tests_folder = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(tests_folder))
+
+import phplexer
+import phpparser
+
+FIXTURES = sorted(glob.glob(os.path.join(tests_folder, 'fixtures', 'lexer', '*.php')))
+
+# The fixtures use syntax up to PHP 7.4
+MIN_PHP_VERSION = 70400
+
+# Edge cases with the tokens that token_get_all() returns for them in PHP 7.4
+CASES = [
+    ('unterminated single quoted string', u"<?php $a = 'abc\n$b;\n", [
+        ('T_OPEN_TAG', u'<?php ', 1),
+        ('T_VARIABLE', u'$a', 1),
+        ('T_WHITESPACE', u' ', 1),
+        (None, u'=', 0),
+        ('T_WHITESPACE', u' ', 1),
+        ('T_ENCAPSED_AND_WHITESPACE', u"'abc\n$b;\n", 1),
+    ]),
+    ('unterminated binary string', u"<?php b'abc", [
+        ('T_OPEN_TAG', u'<?php ', 1),
+        ('T_ENCAPSED_AND_WHITESPACE', u"b'abc", 1),
+    ]),
+    ('unterminated double quoted string', u'<?php "abc $name->first', [
+        ('T_OPEN_TAG', u'<?php ', 1),
+        (None, u'"', 0),
+        ('T_ENCAPSED_AND_WHITESPACE', u'abc ', 1),
+        ('T_VARIABLE', u'$name', 1),
+        ('T_OBJECT_OPERATOR', u'->', 1),
+        ('T_STRING', u'first', 1),
+    ]),
+    ('unterminated comment', u'<?php /* abc\n', [
+        ('T_OPEN_TAG', u'<?php ', 1),
+        ('T_COMMENT', u'/* abc\n', 1),
+    ]),
+    ('unterminated doc comment', u'<?php\n/**\n * @return Foo\n', [
+        ('T_OPEN_TAG', u'<?php\n', 1),
+        ('T_DOC_COMMENT', u'/**\n * @return Foo\n', 2),
+    ]),
+    ('heredoc', u'<?php\n$a = <<<EOT\nHello $name\nEOT;\n', [
+        ('T_OPEN_TAG', u'<?php\n', 1),
+        ('T_VARIABLE', u'$a', 2),
+        ('T_WHITESPACE', u' ', 2),
+        (None, u'=', 0),
+        ('T_WHITESPACE', u' ', 2),
+        ('T_START_HEREDOC', u'<<<EOT\n', 2),
+        ('T_ENCAPSED_AND_WHITESPACE', u'Hello ', 3),
+        ('T_VARIABLE', u'$name', 3),
+        ('T_ENCAPSED_AND_WHITESPACE', u'\n', 3),
+        ('T_END_HEREDOC', u'EOT', 4),
+        (None, u';', 0),
+        ('T_WHITESPACE', u'\n', 4),
+    ]),
+    ('nowdoc', u"<?php\n<<<'EOT'\nRaw $name {$x}\nEOT;\n", [
+        ('T_OPEN_TAG', u'<?php\n', 1),
+        ('T_START_HEREDOC', u"<<<'EOT'\n", 2),
+        ('T_ENCAPSED_AND_WHITESPACE', u'Raw $name {$x}\n', 3),
+        ('T_END_HEREDOC', u'EOT', 4),
+        (None, u';', 0),
+        ('T_WHITESPACE', u'\n', 4),
+    ]),
+    ('indented heredoc', u'<?php\n<<<"EOT"\n    a\n    EOT;\n', [
+        ('T_OPEN_TAG', u'<?php\n', 1),
+        ('T_START_HEREDOC', u'<<<"EOT"\n', 2),
+        ('T_ENCAPSED_AND_WHITESPACE', u'    a\n', 3),
+        ('T_END_HEREDOC', u'    EOT', 4),
+        (None, u';', 0),
+        ('T_WHITESPACE', u'\n', 4),
+    ]),
+    ('empty heredoc', u'<?php\n<<<EOT\nEOT;\n', [
+        ('T_OPEN_TAG', u'<?php\n', 1),
+        ('T_START_HEREDOC', u'<<<EOT\n', 2),
+        ('T_END_HEREDOC', u'EOT', 3),
+        (None, u';', 0),
+        ('T_WHITESPACE', u'\n', 3),
+    ]),
+    ('close tag in line comments', u'<?php // a ?>b<?php # c ?>\nd', [
+        ('T_OPEN_TAG', u'<?php ', 1),
+        ('T_COMMENT', u'// a ', 1),
+        ('T_CLOSE_TAG', u'?>', 1),
+        ('T_INLINE_HTML', u'b', 1),
+        ('T_OPEN_TAG', u'<?php ', 1),
+        ('T_COMMENT', u'# c ', 1),
+        ('T_CLOSE_TAG', u'?>\n', 1),
+        ('T_INLINE_HTML', u'd', 2),
+    ]),
+    ('close tag in block comment', u'<?php /* ?> */', [
+        ('T_OPEN_TAG', u'<?php ', 1),
+        ('T_COMMENT', u'/* ?> */', 1),
+    ]),
+    ('class constant', u'<?php Foo::class;', [
+        ('T_OPEN_TAG', u'<?php ', 1),
+        ('T_STRING', u'Foo', 1),
+        ('T_DOUBLE_COLON', u'::', 1),
+        ('T_CLASS', u'class', 1),
+        (None, u';', 0),
+    ]),
+    ('keyword property', u'<?php $a->class; $a -> list;', [
+        ('T_OPEN_TAG', u'<?php ', 1),
+        ('T_VARIABLE', u'$a', 1),
+        ('T_OBJECT_OPERATOR', u'->', 1),
+        ('T_STRING', u'class', 1),
+        (None, u';', 0),
+        ('T_WHITESPACE', u' ', 1),
+        ('T_VARIABLE', u'$a', 1),
+        ('T_WHITESPACE', u' ', 1),
+        ('T_OBJECT_OPERATOR', u'->', 1),
+        ('T_WHITESPACE', u' ', 1),
+        ('T_STRING', u'list', 1),
+        (None, u';', 0),
+    ]),
+]
+
+
+def get_php_version():
+    '''
+    Return PHP_VERSION_ID of the php binary on the path, or None
+    '''
+    if not phpparser.get_php_key():
+        return None
+    try:
+        return int(subprocess.Popen(['php', '-r', 'echo PHP_VERSION_ID;'], stdout=subprocess.PIPE).communicate()[0])
+    except (OSError, ValueError):
+        return None
+
+
+def normalize(tokens):
+    '''
+    Undo the ways in which PHP 8 tokenizes the fixtures differently from PHP
+    7, which the lexer follows: namespaced names are single tokens, line
+    comments leave their newline to the whitespace after them, and '&'
+    before a variable has a token of its own.
+    '''
+    result = []
+    for kind, stmt, line in tokens:
+        if kind in ('T_NAME_QUALIFIED', 'T_NAME_FULLY_QUALIFIED', 'T_NAME_RELATIVE'):
+            parts = stmt.split('\\')
+            for i in range(0, len(parts)):
+                if i > 0:
+                    result.append(('T_NS_SEPARATOR', '\\', line))
+                if parts[i]:
+                    if i == 0 and parts[i].lower() == 'namespace':
+                        result.append(('T_NAMESPACE', parts[i], line))
+                    else:
+                        result.append(('T_STRING', parts[i], line))
+        elif kind in ('T_AMPERSAND_FOLLOWED_BY_VAR_OR_VARARG', 'T_AMPERSAND_NOT_FOLLOWED_BY_VAR_OR_VARARG'):
+            result.append((None, stmt, 0))
+        elif kind == 'T_WHITESPACE' and result and result[-1][0] == 'T_COMMENT' and not result[-1][1].startswith('/*') and not result[-1][1].endswith('\n') and stmt.startswith('\n'):
+            previous = result.pop()
+            result.append((previous[0], previous[1] + '\n', previous[2]))
+            if len(stmt) > 1:
+                result.append((kind, stmt[1:], line + 1))
+        else:
+            result.append((kind, stmt, line))
+
+    return result
+
+
+class LexerTest(unittest.TestCase):
+    def test_tokens_cover_source(self):
+        for filename in FIXTURES:
+            with open(filename, 'rb') as f:
+                source = f.read().decode('utf-8')
+            tokens = phplexer.get_all_tokens(source)
+            self.assertEqual(source, u''.join([stmt for kind, stmt, line in tokens]), filename)
+
+    def test_cases(self):
+        for name, source, expected in CASES:
+            self.assertEqual(expected, phplexer.get_all_tokens(source), name)
+
+
+class ParityTest(unittest.TestCase):
+    def setUp(self):
+        version = get_php_version()
+        if version == None:
+            self.skipTest('php is not on the path')
+        if version < MIN_PHP_VERSION:
+            self.skipTest('the fixtures need PHP 7.4 or later')
+
+    def tearDown(self):
+        phpparser.close_worker()
+        phpparser.set_tokenizer('php')
+
+    def test_fixtures(self):
+        for filename in FIXTURES:
+            phpparser.set_tokenizer('php')
+            expected = normalize(phpparser.get_all_tokens(filename=filename))
+            phpparser.set_tokenizer('python')
+            actual = phpparser.get_all_tokens(filename=filename)
+            for i in range(0, min(len(expected), len(actual))):
+                self.assertEqual(expected[i], actual[i], '{filename}: token {i:d}'.format(filename=os.path.basename(filename), i=i))
+            self.assertEqual(len(expected), len(actual), os.path.basename(filename))
+
+    def test_cases(self):
+        phpparser.set_tokenizer('php')
+        for name, source, expected in CASES:
+            self.assertEqual(expected, normalize(phpparser.get_all_tokens(source)), name)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,139 @@
+'''
+Tests for the parser, using the pure Python lexer so that PHP is not needed:
+
+    python -m unittest discover tests
+'''
+
+import os
+import sys
+import random
+import shutil
+import tempfile
+import unittest
+
+tests_folder = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(tests_folder))
+
+import intel
+import phpparser
+
+FIXTURES = os.path.join(tests_folder, 'fixtures', 'parser')
+
+
+def large_class(methods):
+    lines = ['<?php', 'class Big extends Base {']
+    for i in range(0, methods):
+        lines.append('    public function method{i:d}($a) {{'.format(i=i))
+        lines.append('        $s = "{ not a brace";')
+        lines.append('        if ($a) { return $a; }')
+        lines.append('        return $this->method{i:d}($a);'.format(i=i))
+        lines.append('    }')
+    lines.append('}')
+    lines.append('class After {}')
+    return '\n'.join(lines) + '\n'
+
+
+class ClassSpansTest(unittest.TestCase):
+    def setUp(self):
+        self.scan_code = phpparser.scan_code
+        self.scanned = []
+
+        def scan_code(source, pos, end, in_php=True):
+            self.scanned.append([pos, pos])
+            for item in self.scan_code(source, pos, end, in_php):
+                self.scanned[-1][1] = item[1]
+                yield item
+
+        phpparser.scan_code = scan_code
+
+    def tearDown(self):
+        phpparser.scan_code = self.scan_code
+
+    def test_edit_inside_large_class(self):
+        source = large_class(500)
+        spans, checkpoints = phpparser.scan_class_spans(source)[:2]
+        point = source.index('return', source.index('function method250('))
+        edited = source[:point] + 'x' + source[point:]
+
+        expected = phpparser.scan_class_spans(edited)[:2]
+        del self.scanned[:]
+        updated = phpparser.update_class_spans(source, spans, checkpoints, edited)
+        self.assertEqual(expected, updated)
+        self.assertEqual(['Big', 'After'], [span[2] for span in updated[0]])
+
+        # Only the method being edited is scanned again
+        self.assertEqual(1, len(self.scanned))
+        start, end = self.scanned[0]
+        self.assertTrue(start >= edited.index('function method250('))
+        self.assertTrue(end <= edited.index('function method252('))
+
+    def test_edit_closing_class(self):
+        source = large_class(20)
+        spans, checkpoints = phpparser.scan_class_spans(source)[:2]
+        point = source.index('public function method10(')
+        edited = source[:point] + '}\n' + source[point:]
+        self.assertEqual(phpparser.scan_class_spans(edited)[:2], phpparser.update_class_spans(source, spans, checkpoints, edited))
+
+    def test_random_edits(self):
+        snippets = ['{', '}', ';', "'", '"', '/*', '*/', '//', '\n', 'class Foo ', 'trait T {', '?>', '<?php ', '<<<EOT\n', '\nEOT;\n', 'x']
+        rnd = random.Random(0)
+        for i in range(0, 20):
+            source = large_class(5)
+            spans, checkpoints = phpparser.scan_class_spans(source)[:2]
+            for j in range(0, 20):
+                pos = rnd.randint(0, len(source))
+                if rnd.random() < 0.3:
+                    edited = source[:pos] + source[pos + rnd.randint(1, 10):]
+                else:
+                    edited = source[:pos] + rnd.choice(snippets) + source[pos:]
+                spans, checkpoints = phpparser.update_class_spans(source, spans, checkpoints, edited)
+                self.assertEqual(phpparser.scan_class_spans(edited)[:2], (spans, checkpoints), repr(edited))
+                source = edited
+
+
+class TraitsTest(unittest.TestCase):
+    def setUp(self):
+        self.tokenizer = phpparser._tokenizer
+        self.backend = intel._store_backend
+        phpparser.set_tokenizer('python')
+        self.root = tempfile.mkdtemp()
+        self.filename = os.path.join(self.root, 'traits.php')
+        shutil.copy(os.path.join(FIXTURES, 'traits.php'), self.filename)
+        self.declarations = phpparser.scan_file(self.filename)
+
+    def tearDown(self):
+        phpparser.set_tokenizer(self.tokenizer)
+        intel.set_store_backend(self.backend)
+        intel.reset()
+        intel._stores.clear()
+        shutil.rmtree(self.root)
+
+    def get_names(self, class_name):
+        return sorted([(i.kind, i.name) for i in self.declarations if i.class_name == class_name and i.name])
+
+    def test_traits_are_classes(self):
+        self.assertEqual([('func', 'discount'), ('var', '$rate')], self.get_names('Discounts'))
+        self.assertEqual([('func', 'round')], self.get_names('Rounding'))
+        self.assertEqual([('func', 'total')], self.get_names('Invoice'))
+        self.assertEqual([], self.get_names('__global__'))
+
+    def test_used_traits(self):
+        invoice = [i for i in self.declarations if i.class_name == 'Invoice' and not i.name]
+        self.assertEqual('Discounts,Rounding', invoice[0].implements)
+
+    def test_members(self):
+        intel.set_store_backend('files')
+        index = intel.FolderIndex(self.root)
+        intel.save(self.declarations, self.root, self.filename)
+        index.update(self.filename, *set([i.class_name for i in self.declarations]))
+        index.save()
+        intel.load_indexes([self.root])
+
+        self.assertEqual('float', intel.get_members('Discounts').get('discount').returns)
+        members = intel.get_members('Invoice')
+        for name in ('total', 'discount', 'round', '$rate'):
+            self.assertTrue(members.get(name), name)
+
+
+if __name__ == '__main__':
+    unittest.main()
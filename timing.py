@@ -0,0 +1,120 @@
+'''
+SublimePHPIntel for Sublime Text 2
+Copyright 2012 John Watson <https://github.com/jotson>
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights to
+use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of
+the Software, and to permit persons to whom the Software is furnished to do so,
+subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+'''
+
+import time
+import threading
+from collections import deque
+
+# Number of recent timings kept for each phase
+WINDOW = 1000
+
+_enabled = False
+_phases = {}
+_lock = threading.Lock()
+
+
+def enable(enabled=True):
+    '''
+    Turn timing on or off. Timings are discarded when it is turned off.
+    '''
+    global _enabled
+    _enabled = bool(enabled)
+    if not _enabled:
+        reset()
+
+
+def is_enabled():
+    return _enabled
+
+
+def start():
+    '''
+    Return a start time for stop(), or None when timing is off
+    '''
+    if _enabled:
+        return time.time()
+
+
+def stop(phase, started):
+    '''
+    Record the time since started, as returned by start(), against phase
+    '''
+    if started == None:
+        return
+    elapsed = time.time() - started
+    with _lock:
+        timings = _phases.get(phase)
+        if timings == None:
+            timings = _phases[phase] = [0, 0.0, deque(maxlen=WINDOW)]
+        timings[0] += 1
+        timings[1] += elapsed
+        timings[2].append(elapsed)
+
+
+def reset():
+    with _lock:
+        _phases.clear()
+
+
+def percentile(ordered, p):
+    '''
+    Return the p-th percentile of an ordered list
+    '''
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, int(len(ordered) * p / 100.0))]
+
+
+def stats():
+    '''
+    Return {phase: {...}} with the number of calls and total time of every
+    phase, and the median, 95th and 99th percentile and slowest of its most
+    recent timings. Times are in milliseconds.
+    '''
+    with _lock:
+        phases = [(phase, t[0], t[1], sorted(t[2])) for phase, t in _phases.items()]
+
+    result = {}
+    for phase, count, total, recent in phases:
+        result[phase] = {
+            'count': count,
+            'total': total * 1000,
+            'p50': percentile(recent, 50) * 1000,
+            'p95': percentile(recent, 95) * 1000,
+            'p99': percentile(recent, 99) * 1000,
+            'max': (recent[-1] if recent else 0.0) * 1000,
+        }
+
+    return result
+
+
+def report(phases):
+    '''
+    Format the result of stats() as a table
+    '''
+    lines = ['{phase:<32} {count:>8} {total:>10} {p50:>9} {p95:>9} {p99:>9} {max:>9}'.format(phase='phase', count='count', total='total ms', p50='p50 ms', p95='p95 ms', p99='p99 ms', max='max ms')]
+    for phase in sorted(phases):
+        s = phases[phase]
+        lines.append('{phase:<32} {count:8d} {total:10.1f} {p50:9.3f} {p95:9.3f} {p99:9.3f} {max:9.3f}'.format(phase=phase, **s))
+
+    return '\n'.join(lines)
@@ -0,0 +1,369 @@
+'''
+SublimePHPIntel for Sublime Text 2
+Copyright 2012 John Watson <https://github.com/jotson>
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights to
+use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of
+the Software, and to permit persons to whom the Software is furnished to do so,
+subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+'''
+
+import os
+import sys
+import time
+import errno
+import select
+import struct
+import threading
+
+try:
+    import ctypes
+    import ctypes.util
+except ImportError:
+    ctypes = None
+
+# Folders that never hold project source, or that change whenever the
+# project is scanned
+IGNORE_FOLDERS = ('.git', '.hg', '.svn', '.phpintel')
+
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0x00000800
+IN_CLOEXEC = 0x00080000
+WATCH_MASK = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR
+
+
+class Watcher(threading.Thread):
+    '''
+    Watches folders for PHP files that are added, changed or removed, by
+    anything, and reports them in batches.
+
+    Changes are collected until none have arrived for delay seconds, or for
+    at most max_delay seconds while they keep coming, and then passed to
+    callback(paths) together. paths holds files that were added, changed or
+    removed, and folders that were moved or removed, or in which changes
+    were missed, and so need everything below them scanned again.
+
+    inotify is used on Linux. Elsewhere the folders are polled every
+    interval seconds: the modification time of every folder is checked,
+    which catches files being added or removed, and a slice of the files is
+    checked for changes on each poll.
+
+    Files for which exclude(path) returns True are not reported, and folders
+    for which exclude_folder(path) returns True are not watched at all.
+    '''
+    def __init__(self, folders, callback, extension='.php', exclude=None, exclude_folder=None, delay=1.0, max_delay=10.0, interval=2.0):
+        self.folders = list(folders)
+        self.callback = callback
+        self.extension = extension
+        self.exclude = exclude
+        self.exclude_folder = exclude_folder
+        self.delay = delay
+        self.max_delay = max_delay
+        self.interval = interval
+        self.changed = set()
+        self.first_change = None
+        self.last_change = None
+        self.stopped = threading.Event()
+        threading.Thread.__init__(self)
+        self.daemon = True
+
+    def stop(self):
+        self.stopped.set()
+
+    def run(self):
+        inotify = Inotify.create()
+        if inotify:
+            try:
+                for folder in self.folders:
+                    inotify.add_tree(folder, self.walk)
+            except OSError as e:
+                # Usually the limit on the number of watches
+                print 'SublimePHPIntel: Could not watch folders with inotify, polling instead: ' + str(e)
+                inotify.close()
+                inotify = None
+
+        if inotify:
+            try:
+                self.watch(inotify)
+            finally:
+                inotify.close()
+        else:
+            self.poll()
+
+    def watch(self, inotify):
+        while not self.stopped.is_set():
+            for path, mask in inotify.read(self.timeout()):
+                if mask & IN_Q_OVERFLOW:
+                    for folder in self.folders:
+                        self.add(folder)
+                elif mask & IN_ISDIR:
+                    if self.ignore_folder(path):
+                        continue
+                    if mask & (IN_CREATE | IN_MOVED_TO):
+                        try:
+                            inotify.add_tree(path, self.walk)
+                        except OSError:
+                            pass
+                        for filename in self.find_files(path):
+                            self.add(filename)
+                    elif mask & (IN_DELETE | IN_MOVED_FROM):
+                        self.add(path)
+                elif self.is_source(path):
+                    self.add(path)
+            self.flush()
+
+    def poll(self):
+        # folder -> mtime, file -> (mtime, size) and folder -> its files
+        folders = {}
+        files = {}
+        contents = {}
+        for folder in self.folders:
+            self.snapshot(folder, folders, files, contents)
+        checked = 0
+
+        while True:
+            self.stopped.wait(self.interval)
+            if self.stopped.is_set():
+                break
+
+            # Folders whose modification time changed have had entries added
+            # or removed
+            for folder, mtime in folders.items():
+                if folder not in folders:
+                    continue
+                try:
+                    current = os.stat(folder).st_mtime
+                except OSError:
+                    current = None
+                if current == mtime:
+                    continue
+                if current == None:
+                    self.forget(folder, folders, files, contents)
+                    self.add(folder)
+                    continue
+                folders[folder] = current
+                try:
+                    names = os.listdir(folder)
+                except OSError:
+                    continue
+                for name in names:
+                    path = os.path.join(folder, name)
+                    if os.path.isdir(path):
+                        if path not in folders and not self.ignore_folder(path):
+                            self.snapshot(path, folders, files, contents)
+                            for filename in self.find_files(path):
+                                self.add(filename)
+                    elif path not in files and self.is_source(path):
+                        files[path] = self.signature(path)
+                        contents.setdefault(folder, set()).add(path)
+                        self.add(path)
+                names = set(names)
+                for path in list(contents.get(folder, ())):
+                    if os.path.basename(path) not in names:
+                        files.pop(path, None)
+                        contents[folder].discard(path)
+                        self.add(path)
+
+            # Files changed in place don't change their folder, so check a
+            # slice of them on every poll
+            paths = files.keys()
+            count = min(len(paths), 5000)
+            for i in range(0, count):
+                path = paths[(checked + i) % len(paths)]
+                signature = self.signature(path)
+                if signature != files[path]:
+                    files[path] = signature
+                    self.add(path)
+            checked += count
+
+            self.flush()
+
+    def snapshot(self, folder, folders, files, contents):
+        for root, dirs, names in self.walk(folder):
+            try:
+                folders[root] = os.stat(root).st_mtime
+            except OSError:
+                continue
+            contents[root] = set()
+            for name in names:
+                path = os.path.join(root, name)
+                if self.is_source(path):
+                    files[path] = self.signature(path)
+                    contents[root].add(path)
+
+    def forget(self, folder, folders, files, contents):
+        prefix = folder + os.sep
+        for path in [f for f in folders if f == folder or f.startswith(prefix)]:
+            del folders[path]
+            for filename in contents.pop(path, ()):
+                files.pop(filename, None)
+
+    def signature(self, path):
+        try:
+            st = os.stat(path)
+            return st.st_mtime, st.st_size
+        except OSError:
+            return None
+
+    def walk(self, folder):
+        for root, dirs, names in os.walk(folder, followlinks=True):
+            dirs[:] = [d for d in dirs if not self.ignore_folder(os.path.join(root, d))]
+            yield root, dirs, names
+
+    def find_files(self, folder):
+        for root, dirs, names in self.walk(folder):
+            for name in names:
+                path = os.path.join(root, name)
+                if self.is_source(path):
+                    yield path
+
+    def ignore_folder(self, path):
+        if os.path.basename(path) in IGNORE_FOLDERS:
+            return True
+        return bool(self.exclude_folder and self.exclude_folder(path))
+
+    def is_source(self, path):
+        if os.path.splitext(path)[1] != self.extension:
+            return False
+        for name in IGNORE_FOLDERS:
+            if os.sep + name + os.sep in path:
+                return False
+        return not (self.exclude and self.exclude(path))
+
+    def add(self, path):
+        now = time.time()
+        if not self.changed:
+            self.first_change = now
+        self.last_change = now
+        self.changed.add(path)
+
+    def timeout(self):
+        '''
+        How long to wait for more changes before the next flush() is due
+        '''
+        if not self.changed:
+            return self.interval
+        now = time.time()
+        return max(0, min(self.last_change + self.delay, self.first_change + self.max_delay) - now)
+
+    def flush(self):
+        '''
+        Report the changes collected so far once they have settled
+        '''
+        if not self.changed or self.timeout() > 0:
+            return
+        paths = sorted(self.changed)
+        self.changed = set()
+        try:
+            self.callback(paths)
+        except Exception as e:
+            print 'SublimePHPIntel: Error handling changed files: ' + str(e)
+
+
+class Inotify(object):
+    '''
+    Minimal inotify binding
+    '''
+    def __init__(self, libc, fd):
+        self.libc = libc
+        self.fd = fd
+        self.watches = {}
+
+    @classmethod
+    def create(cls):
+        '''
+        Return an Inotify, or None when inotify is not available
+        '''
+        if ctypes == None or not sys.platform.startswith('linux'):
+            return None
+        try:
+            libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+            fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        except (OSError, AttributeError):
+            return None
+        if fd < 0:
+            return None
+
+        return cls(libc, fd)
+
+    def close(self):
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
+
+    def add_watch(self, path):
+        wd = self.libc.inotify_add_watch(self.fd, path.encode(sys.getfilesystemencoding() or 'utf-8'), WATCH_MASK)
+        if wd < 0:
+            e = ctypes.get_errno()
+            if e in (errno.ENOENT, errno.ENOTDIR, errno.EACCES):
+                return
+            raise OSError(e, os.strerror(e), path)
+        self.watches[wd] = path
+
+    def add_tree(self, folder, walk):
+        for root, dirs, names in walk(folder):
+            self.add_watch(root)
+
+    def read(self, timeout):
+        '''
+        Wait up to timeout seconds and return (path, mask) for each event
+        '''
+        try:
+            ready = select.select([self.fd], [], [], timeout)[0]
+        except select.error as e:
+            if e.args[0] == errno.EINTR:
+                return []
+            raise
+        if not ready:
+            return []
+
+        try:
+            data = os.read(self.fd, 65536)
+        except OSError as e:
+            if e.errno in (errno.EAGAIN, errno.EINTR):
+                return []
+            raise
+
+        events = []
+        offset = 0
+        while offset + 16 <= len(data):
+            wd, mask, cookie, length = struct.unpack_from('iIII', data, offset)
+            name = data[offset + 16:offset + 16 + length].rstrip('\0')
+            offset += 16 + length
+            folder = self.watches.get(wd)
+            if isinstance(folder, unicode):
+                name = name.decode(sys.getfilesystemencoding() or 'utf-8', 'replace')
+            if mask & IN_IGNORED:
+                self.watches.pop(wd, None)
+            elif mask & IN_Q_OVERFLOW:
+                events.append((None, mask))
+            elif folder != None and name:
+                events.append((os.path.join(folder, name), mask))
+            elif folder != None and mask & (IN_DELETE_SELF | IN_MOVE_SELF):
+                events.append((folder, mask | IN_ISDIR | IN_DELETE))
+
+        return events